@@ -1,10 +1,22 @@
 import os
-import concurrent.futures
-from flask import Flask, render_template, jsonify, request
+import json
+import queue
+import time
+import threading
+import metrics
+from datetime import timedelta
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 from flask_session import Session
 from dotenv import load_dotenv
-from connectwise_client import ConnectWiseClient
+from connectwise_client import MEMBER_FIELDS, ConnectWiseClient
+from date_shards import parse_date
 from llm_processor import LLMProcessor
+from note_preprocessing import NotePreprocessor
+from ticket_pipeline import TicketPipeline
+from member_directory import MemberDirectory
+from report_jobs import JobManager
+from report_batch import NO_TICKETS_REPORT, run_batch_reports
+from report_store import ReportStore, delta_conditions, high_water_mark, period_start_mark
 from auth import auth_bp, init_auth, login_required, get_current_user
 
 load_dotenv()
@@ -18,10 +30,29 @@ if not secret_key:
     secret_key = os.urandom(24).hex()
 
 app.config['SECRET_KEY'] = secret_key
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = '/app/flask_session'
 app.config['SESSION_PERMANENT'] = False
-Session(app)
+
+# SESSION_BACKEND: filesystem (pickled files, survive restarts), memory (in-process LRU,
+# no disk I/O per request) or cookie (Flask's signed cookie holding only compact user claims)
+session_backend = os.getenv('SESSION_BACKEND', 'filesystem').lower()
+app.config['SESSION_BACKEND'] = session_backend
+if session_backend == 'filesystem':
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SESSION_FILE_DIR'] = '/app/flask_session'
+    Session(app)
+elif session_backend == 'memory':
+    from session_store import LRUSessionCache
+    session_ttl = int(os.getenv('SESSION_TTL', '28800'))
+    app.config['SESSION_TYPE'] = 'cachelib'
+    # Flask-Session stores every session with this lifetime as its timeout
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=session_ttl)
+    app.config['SESSION_CACHELIB'] = LRUSessionCache(
+        max_entries=int(os.getenv('SESSION_MAX_ENTRIES', '1000')),
+        default_timeout=session_ttl
+    )
+    Session(app)
+elif session_backend != 'cookie':
+    raise ValueError(f"Unknown SESSION_BACKEND: {session_backend}. Supported: filesystem, memory, cookie")
 
 # Initialize and register authentication
 auth_configured = init_auth(app)
@@ -29,14 +60,64 @@ app.register_blueprint(auth_bp)
 
 # Initialize ConnectWise client once
 cw_client = None
+async_cw_client = None
+
+# Background report jobs (REPORT_JOB_WORKERS bounds concurrent reports)
+job_manager = JobManager()
+
+# Generated reports, kept so later requests can extend them (REPORT_STORE_PATH; "off" disables)
+report_store = ReportStore.from_env()
+
+_cw_client_lock = threading.Lock()
+# Separate from _cw_client_lock: the async client is built from get_cw_client()
+_async_cw_client_lock = threading.Lock()
 
 def get_cw_client():
     global cw_client
-    if cw_client is None:
-        cw_client = ConnectWiseClient()
+    with _cw_client_lock:
+        if cw_client is None:
+            cw_client = ConnectWiseClient()
     return cw_client
 
 
+# Member roster served from memory (MEMBER_CACHE_TTL); warmed in the background at startup
+member_directory = MemberDirectory(lambda: get_cw_client().get_members(fields=MEMBER_FIELDS))
+member_directory.refresh_async()
+
+# SDK clients are shared by every report; create them before the first request needs one
+threading.Thread(target=LLMProcessor.preload_clients, name="llm-preload", daemon=True).start()
+
+
+def get_async_cw_client():
+    """Shared asyncio detail fetcher (enabled with CW_ASYNC_CLIENT=1)."""
+    global async_cw_client
+    with _async_cw_client_lock:
+        if async_cw_client is None:
+            from async_connectwise_client import AsyncClientAdapter
+            cw = get_cw_client()
+            async_cw_client = AsyncClientAdapter(scheduler=cw.scheduler, cache=cw.cache,
+                                                 single_flight=cw.single_flight)
+    return async_cw_client
+
+
+def _collect_ticket_data(cw, conditions, member_id, on_progress=None, preprocessor=None, date_range=None,
+                         cache_query=True):
+    """
+    Search service and project tickets and fetch their details through the shared pipeline.
+    on_progress: Optional callback(stage, done, total) for progress reporting.
+    preprocessor: Optional NotePreprocessor applied to each ticket's notes.
+    date_range: Optional (start_date, end_date) of dateEntered, searched in date shards.
+    cache_query: False for a delta report, whose high-water mark makes every search a one-off.
+    Returns (ticket_count, processed_data, failed_count).
+    """
+    async_client = get_async_cw_client() if os.getenv('CW_ASYNC_CLIENT') else None
+    # Only fetch notes created by this technician
+    pipeline = TicketPipeline(cw, member_id=member_id, preprocessor=preprocessor, async_client=async_client,
+                              cache_query=cache_query)
+    processed_data = pipeline.collect(conditions, on_progress=on_progress, date_range=date_range)
+    return pipeline.ticket_count, processed_data, pipeline.failed_count
+
+
 @app.route('/')
 @login_required
 def index():
@@ -48,21 +129,29 @@ def index():
 @app.route('/api/members')
 @login_required
 def get_members():
-    """Fetch list of ConnectWise technicians."""
+    """Fetch list of ConnectWise technicians (supports If-None-Match)."""
     try:
-        cw = get_cw_client()
-        members = cw.get_members() or []
-        # Return simplified member data
-        result = [
-            {
-                'id': m.get('identifier'),
-                'name': f"{m.get('firstName', '')} {m.get('lastName', '')}".strip(),
-                'identifier': m.get('identifier')
-            }
-            for m in members
-            if m.get('identifier')
-        ]
-        return jsonify(result)
+        members, etag = member_directory.get_members()
+        response = jsonify(members)
+        response.set_etag(etag)
+        # Browsers must revalidate, which is a cheap 304 while the roster is unchanged
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/members/search')
+@login_required
+def search_members():
+    """Find technicians by identifier or name prefix: /api/members/search?q=jo&limit=20"""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        return jsonify(member_directory.search(request.args.get('q', ''), limit=limit))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -78,87 +167,371 @@ def get_providers():
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/generate', methods=['POST'])
-@login_required
-def generate_report():
-    """Generate strategic value report."""
+def _parse_report_request(data):
+    """Validate a report request body. Returns (params, error_message)."""
+    member_id = data.get('member_id')
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    provider_id = data.get('provider', 'gemini:gemini-2.5-pro')
+    
+    if ':' in provider_id:
+        provider, model = provider_id.split(':', 1)
+    else:
+        provider = provider_id
+        model = None
+    
+    # A model the user picked is only replaced by another provider's when they opt in with "failover"
+    failover = data.get('failover')
+    if failover is not None:
+        failover = bool(failover)
+    elif model and 'provider' in data:
+        failover = False
+    
+    if not all([member_id, start_date, end_date]):
+        return None, 'Missing required fields: member_id, start_date, end_date'
     try:
-        data = request.json
-        member_id = data.get('member_id')
-        technician_name = data.get('technician_name', member_id)
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
-        provider_id = data.get('provider', 'gemini:gemini-2.5-pro')
-        
-        if ':' in provider_id:
-            provider, model = provider_id.split(':', 1)
+        if parse_date(start_date) > parse_date(end_date):
+            return None, 'start_date must not be after end_date'
+    except ValueError:
+        return None, 'start_date and end_date must be YYYY-MM-DD dates'
+    
+    # The date range is applied by the search, in date shards
+    conditions = f'owner/identifier="{member_id}"'
+    
+    # A delta report extends a stored report with only the tickets entered or updated since
+    base_report = None
+    base_report_id = data.get('base_report_id')
+    if base_report_id:
+        if report_store is None:
+            return None, 'Stored reports are disabled (REPORT_STORE_PATH=off)'
+        base_report = report_store.get(base_report_id)
+        if base_report is None:
+            return None, f'Report not found: {base_report_id}'
+        if base_report['member_id'] != member_id or base_report['start_date'] != start_date:
+            return None, 'base_report_id must be a report for the same member_id and start_date'
+        base_end_date = parse_date(base_report['end_date'])
+        if parse_date(end_date) < base_end_date:
+            return None, 'end_date must not be before the end_date of the base report'
+        # Tickets entered between the two end dates were never searched, whatever their lastUpdated
+        covered_until = base_end_date if parse_date(end_date) > base_end_date else None
+        conditions = delta_conditions(conditions, base_report['high_water'], covered_until)
+    
+    return {
+        'member_id': member_id,
+        'technician_name': data.get('technician_name', member_id),
+        'start_date': start_date,
+        'end_date': end_date,
+        'provider': provider,
+        'model': model,
+        'failover': failover,
+        'bypass_cache': bool(data.get('bypass_cache')),
+        'base_report': base_report,
+        'extends_base': bool(base_report) and parse_date(end_date) > parse_date(base_report['end_date']),
+        'conditions': conditions
+    }, None
+
+
+def _new_llm(params):
+    """The LLMProcessor for a parsed report request."""
+    return LLMProcessor(provider=params['provider'], model=params['model'], use_cache=not params['bypass_cache'],
+                        failover=params['failover'])
+
+
+def _answered_by(llm):
+    """The provider and model that wrote the report, which may be a fallback's, as a response dict."""
+    provider, model = llm.answered_by or (llm.provider, llm.model)
+    return {'provider': provider, 'model': model}
+
+
+def _store_report(params, high_water, processed_data, report, answered_by, failed_count=0):
+    """Save a finished report with the tickets it covers; returns its report_id (None when storing is off)."""
+    if report_store is None:
+        return None
+    base = params['base_report']
+    if failed_count:
+        # Failed tickets are not in the report, so the next delta must find them again: keep the base's
+        # mark, or start from the period's beginning when there is none or the period was extended
+        if base and not params['extends_base']:
+            high_water = base['high_water']
         else:
-            provider = provider_id
-            model = None
+            high_water = period_start_mark(params['start_date'])
+    ticket_ids = [t.id for t in processed_data] + (base['ticket_ids'] if base else [])
+    return report_store.save(params['member_id'], params['start_date'], params['end_date'], answered_by['provider'],
+                             answered_by['model'], high_water, ticket_ids, report,
+                             base_id=base['report_id'] if base else None)
 
-        
-        if not all([member_id, start_date, end_date]):
-            return jsonify({'error': 'Missing required fields: member_id, start_date, end_date'}), 400
-        
+
+def _run_report(params, on_progress=None):
+    """
+    Run the whole report pipeline and return the /api/generate response body (with a timing breakdown).
+    With a base report only the tickets entered or updated since it are fetched and merged into it.
+    """
+    base = params['base_report']
+    with metrics.collect_timings() as timings:
         cw = get_cw_client()
-        llm = LLMProcessor(provider=provider, model=model)
+        llm = _new_llm(params)
         
-        # Build conditions
-        conditions = f'dateEntered >= [{start_date}] AND dateEntered <= [{end_date}]'
-        conditions = f'(owner/identifier="{member_id}") AND ({conditions})'
+        high_water = high_water_mark()
+        preprocessor = NotePreprocessor()
+        with metrics.span('report_phase_seconds', phase='collect'):
+            ticket_count, processed_data, failed_count = _collect_ticket_data(
+                cw, params['conditions'], params['member_id'], on_progress=on_progress, preprocessor=preprocessor,
+                date_range=(params['start_date'], params['end_date']), cache_query=not base
+            )
         
-        # Fetch tickets
-        MAX_TICKETS = 1000
-        service_tickets = cw.get_tickets(conditions=conditions, page_size=MAX_TICKETS) or []
-        project_tickets = cw.get_project_tickets(conditions=conditions, page_size=MAX_TICKETS) or []
-        tickets = service_tickets + project_tickets
+        if not ticket_count:
+            if base:
+                # Nothing new: the stored report is still current
+                return {'report': base['report'], 'report_id': base['report_id'], 'delta': True, 'ticket_count': 0,
+                        'timings': timings.to_dict()}
+            return {'report': NO_TICKETS_REPORT, 'timings': timings.to_dict()}
         
-        if not tickets:
-            return jsonify({'report': '# No Tickets Found\n\nNo tickets were found for the selected criteria.'})
+        # Generate report
+        if on_progress:
+            on_progress('llm', 0, None)
+        with metrics.span('report_phase_seconds', phase='llm'):
+            if base:
+                report = llm.merge_report(base['report'], processed_data, params['technician_name'],
+                                          covered_ids=base['ticket_ids'])
+            else:
+                report = llm.summarize_quarterly_work(processed_data, params['technician_name'])
+        answered_by = _answered_by(llm)
+        report_id = _store_report(params, high_water, processed_data, report, answered_by, failed_count)
+    
+    return {
+        'report': report,
+        'report_id': report_id,
+        **answered_by,
+        'delta': bool(base),
+        'ticket_count': ticket_count,
+        'processed_count': len(processed_data),
+        'failed_count': failed_count,
+        'note_compression': preprocessor.stats(),
+        'timings': timings.to_dict()
+    }
+
+
+@app.route('/api/generate', methods=['POST'])
+@login_required
+def generate_report():
+    """
+    Generate strategic value report. Set "bypass_cache": true to skip cached LLM responses.
+    An explicitly chosen "provider": "name:model" is not failed over to other providers unless
+    "failover": true; the response names the provider and model that wrote the report.
+    Pass the report_id of an earlier report as "base_report_id" to extend it with only the
+    tickets entered or updated since (a delta report) instead of rebuilding it; its end_date
+    may move later, never earlier.
+    """
+    try:
+        params, error = _parse_report_request(request.json)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        return jsonify(_run_report(params))
         
-        # Process tickets concurrently
-        def process_ticket(t):
-            t_id = t['id']
-            t_summary = t['summary']
-            t_date = t.get('dateClosed') or t.get('dateEntered') or "Unknown Date"
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def create_report_job():
+    """
+    Queue a report in the background. Takes the same body as /api/generate and
+    returns a job id to poll; an identical in-flight job is reused.
+    """
+    params, error = _parse_report_request(request.json or {})
+    if error:
+        return jsonify({'error': error}), 400
+    
+    key = (params['member_id'], params['start_date'], params['end_date'], params['provider'], params['model'],
+           params['bypass_cache'], params['base_report'] and params['base_report']['report_id'])
+    job, created = job_manager.submit(key, _run_report, params)
+    
+    body = job.to_dict()
+    body['deduplicated'] = not created
+    return jsonify(body), 202
+
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def get_report_job(job_id):
+    """Return a job's status and progress, and its result once finished."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+def _run_batch(params, on_progress=None):
+    """Generate reports for several technicians; the /api/batch job result."""
+    cw = get_cw_client()
+    llm = _new_llm(params)
+    async_client = get_async_cw_client() if os.getenv('CW_ASYNC_CLIENT') else None
+    preprocessor = NotePreprocessor()
+    with metrics.collect_timings() as timings:
+        result = run_batch_reports(cw, llm, params['members'], params['start_date'], params['end_date'],
+                                   preprocessor=preprocessor, async_client=async_client, on_progress=on_progress)
+    result['note_compression'] = preprocessor.stats()
+    result['timings'] = timings.to_dict()
+    return result
+
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def create_batch_job():
+    """
+    Queue reports for several technicians over one date range:
+    {"member_ids": [...], "start_date", "end_date", "provider", "bypass_cache"}.
+    Returns a job id to poll at /api/jobs/<job_id>; the result maps each member to its report.
+    """
+    data = request.json or {}
+    member_ids = data.get('member_ids')
+    if not isinstance(member_ids, list) or not member_ids \
+            or not all(isinstance(m, str) and m and '"' not in m for m in member_ids):
+        return jsonify({'error': 'member_ids must be a non-empty list of member identifiers'}), 400
+    
+    params, error = _parse_report_request(dict(data, member_id=member_ids[0], base_report_id=None))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    member_ids = list(dict.fromkeys(member_ids))
+    members = {}
+    for member_id in member_ids:
+        try:
+            member = member_directory.get(member_id)
+        except Exception:
+            # Names are cosmetic; fall back to the identifier if the roster is unavailable
+            member = None
+        members[member_id] = member['name'] if member and member['name'] else member_id
+    params['members'] = members
+    
+    key = ('batch', tuple(sorted(member_ids)), params['start_date'], params['end_date'], params['provider'],
+           params['model'], params['bypass_cache'])
+    job, created = job_manager.submit(key, _run_batch, params)
+    
+    body = job.to_dict()
+    body['deduplicated'] = not created
+    return jsonify(body), 202
+
+
+def _sse(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/generate/stream', methods=['POST'])
+@login_required
+def generate_report_stream():
+    """
+    Generate a strategic value report as a server-sent event stream:
+    `progress` events while tickets are fetched, `token` events as the LLM
+    writes the report, then `done` (or `error`).
+    """
+    params, error = _parse_report_request(request.json or {})
+    if error:
+        return jsonify({'error': error}), 400
+    
+    def generate():
+        try:
+            cw = get_cw_client()
+            llm = _new_llm(params)
             
-            # Only fetch notes created by this technician
-            notes = cw.get_ticket_notes(t_id, member_id=member_id)
-            notes_text = ""
-            if notes:
-                notes_text = "\n".join([f"- [{n.get('dateCreated')}] {n.get('text')}" for n in notes])
+            # Fetch on a helper thread so progress can be flushed to the client as it happens
+            events = queue.Queue()
             
-            total_time = cw.get_total_time_for_ticket(t_id)
+            def on_progress(stage, done, total):
+                events.put(('progress', {'stage': stage, 'done': done, 'total': total}))
             
-            return {
-                'id': t_id,
-                'summary': t_summary,
-                'date': t_date,
-                'notes': notes_text,
-                'total_hours': total_time
-            }
-        
-        processed_data = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {executor.submit(process_ticket, t): t for t in tickets}
-            for future in concurrent.futures.as_completed(futures):
+            high_water = high_water_mark()
+            preprocessor = NotePreprocessor()
+            timings = metrics.Timings()
+            
+            def collect():
                 try:
-                    data = future.result()
-                    processed_data.append(data)
-                except Exception:
-                    pass  # Skip failed tickets
-        
-        # Generate report
-        report = llm.summarize_quarterly_work(processed_data, technician_name)
-        
-        return jsonify({
-            'report': report,
-            'ticket_count': len(tickets),
-            'processed_count': len(processed_data)
-        })
+                    with metrics.span('report_phase_seconds', phase='collect'):
+                        collected = _collect_ticket_data(
+                            cw, params['conditions'], params['member_id'], on_progress=on_progress,
+                            preprocessor=preprocessor, date_range=(params['start_date'], params['end_date']),
+                            cache_query=not params['base_report']
+                        )
+                    events.put(('collected', collected))
+                except Exception as exc:
+                    events.put(('failed', exc))
+            
+            threading.Thread(target=metrics.bind(collect, timings), daemon=True).start()
+            
+            last_sent = None
+            while True:
+                kind, payload = events.get()
+                if kind == 'collected':
+                    break
+                if kind == 'failed':
+                    raise payload
+                # Coalesce progress so large reports don't flood the stream
+                if last_sent is None or payload['stage'] != last_sent['stage'] \
+                        or payload['done'] == payload['total'] or payload['done'] - last_sent['done'] >= 25:
+                    last_sent = payload
+                    yield _sse('progress', payload)
+            
+            ticket_count, processed_data, failed_count = payload
+            base = params['base_report']
+            summary = {
+                'delta': bool(base),
+                'ticket_count': ticket_count,
+                'processed_count': len(processed_data),
+                'failed_count': failed_count,
+                'note_compression': preprocessor.stats()
+            }
+            
+            if not ticket_count:
+                if base:
+                    # Nothing new: the stored report is still current
+                    yield _sse('token', {'text': base['report']})
+                    yield _sse('done', dict(summary, report_id=base['report_id'], timings=timings.to_dict()))
+                    return
+                yield _sse('token', {'text': NO_TICKETS_REPORT})
+                yield _sse('done', dict(summary, timings=timings.to_dict()))
+                return
+            
+            yield _sse('progress', {'stage': 'llm', 'done': 0, 'total': None})
+            started = time.perf_counter()
+            # The LLM work runs on this thread outside collect_timings, so bind it (and any
+            # map-reduce batches it starts) to the report's timings step by step
+            if base:
+                stream = metrics.bind(llm.stream_merged_report, timings)(
+                    base['report'], processed_data, params['technician_name'], covered_ids=base['ticket_ids']
+                )
+            else:
+                stream = metrics.bind(llm.stream_quarterly_work, timings)(processed_data, params['technician_name'])
+            chunks = []
+            for text in metrics.bind_iter(stream, timings):
+                chunks.append(text)
+                yield _sse('token', {'text': text})
+            metrics.bind(metrics.observe, timings)('report_phase_seconds', time.perf_counter() - started, phase='llm')
+            answered_by = _answered_by(llm)
+            report_id = _store_report(params, high_water, processed_data, "".join(chunks), answered_by,
+                                      failed_count)
+            yield _sse('done', dict(summary, report_id=report_id, timings=timings.to_dict(), **answered_by))
         
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            yield _sse('error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: ConnectWise request, pipeline stage, report phase
+    and LLM call timings plus token counts. Left unauthenticated like most scrape
+    targets; it exposes only aggregate timings and counts.
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,361 @@
+import asyncio
+import inspect
+import os
+import threading
+
+import httpx
+
+from connectwise_client import (
+    ConnectWiseClient,
+    ConnectWiseError,
+    MAX_PAGE_SIZE,
+    PAGE_PREFETCH,
+    REQUEST_TIMEOUT,
+    SEARCH_ENDPOINTS,
+    TICKET_ID_CHUNK_SIZE,
+    TIME_ENTRY_FIELDS,
+    connectwise_settings,
+    group_hours_by_ticket,
+    merge_ticket,
+    note_request,
+    time_entry_conditions,
+    with_fields,
+)
+import metrics
+from date_shards import search_shards, shard_unit
+from request_scheduler import RETRY_STATUSES, RequestScheduler, parse_retry_after
+from single_flight import SingleFlight, request_key
+from ticket_cache import ticket_last_updated
+
+
+class AsyncConnectWiseClient:
+    """
+    asyncio counterpart of ConnectWiseClient for high fan-out detail fetching.
+    One httpx connection pool with keep-alive serves every request, and a
+    semaphore (CW_ASYNC_CONCURRENCY) bounds how many are in flight, so hundreds
+    of note/time requests can be pending without a thread per request.
+    Requests share the scheduler's token bucket and retry policy, and notes/time
+    totals go through the same TicketCache as the sync client when one is given.
+    """
+
+    def __init__(self, scheduler=None, max_concurrency=None, cache=None, single_flight=None):
+        self.base_url, headers = connectwise_settings()
+        self.scheduler = scheduler or RequestScheduler()
+        self.cache = cache
+        # Shared with the sync client, so either can reuse the other's recent results
+        self.single_flight = single_flight or SingleFlight()
+        self.max_concurrency = max_concurrency or int(os.getenv("CW_ASYNC_CONCURRENCY", "64"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _send(self, url, params):
+        """Send one GET under the rate limit and semaphore, retrying transient failures."""
+        scheduler = self.scheduler
+        attempt = 0
+        while True:
+            wait = scheduler.bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            error = None
+            async with self._semaphore:
+                try:
+                    response = await self.client.get(url, params=params)
+                except httpx.TransportError as exc:
+                    error = exc
+            # Back off outside the semaphore, so a retrying request does not hold a slot
+            if error is not None:
+                if attempt >= scheduler.max_retries:
+                    raise error
+                await asyncio.sleep(scheduler.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < scheduler.max_retries:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = scheduler.backoff_delay(attempt, retry_after)
+                if response.status_code == 429:
+                    scheduler.bucket.pause(delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    async def _request(self, endpoint, params=None):
+        """Issue a GET and return the raw response, or None on HTTP errors."""
+        url = f"{self.base_url}/{endpoint}"
+        label = metrics.endpoint_label(endpoint)
+        try:
+            with metrics.span('connectwise_request_seconds', endpoint=label):
+                response = await self._send(url, params)
+            response.raise_for_status()
+            return response
+        except httpx.HTTPStatusError as e:
+            metrics.count('connectwise_request_errors_total', endpoint=label)
+            print(f"Error fetching {url}: {e}")
+            if e.response.text:
+                print(f"Response: {e.response.text}")
+            return None
+        except httpx.HTTPError as e:
+            metrics.count('connectwise_request_errors_total', endpoint=label)
+            print(f"Error fetching {url}: {e}")
+            return None
+
+    async def _get_json(self, endpoint, params=None):
+        """GET and parse a response; returns (data, last_page) or None. Identical concurrent calls share one request."""
+        async def fetch():
+            response = await self._request(endpoint, params=params)
+            if response is None:
+                return None
+            return response.json(), ConnectWiseClient._last_page(response)
+        return await self.single_flight.do_async(request_key(endpoint, params), fetch)
+
+    async def _get(self, endpoint, params=None):
+        result = await self._get_json(endpoint, params=params)
+        if result is None:
+            return None
+        return result[0]
+
+    async def _fetch_page(self, endpoint, params, page, strict=False):
+        """Fetch a single page; returns (records, last_page from the Link header or None)."""
+        page_params = dict(params)
+        page_params["page"] = page
+        result = await self._get_json(endpoint, params=page_params)
+        if result is None:
+            if strict:
+                raise ConnectWiseError(f"Failed to fetch page {page} of {endpoint}")
+            return [], None
+        records, last_page = result
+        return records or [], last_page
+
+    async def _iter(self, endpoint, params=None, page_size=MAX_PAGE_SIZE, prefetch=PAGE_PREFETCH, strict=False):
+        """Async generator over every record of a list endpoint, prefetching pages."""
+        params = dict(params or {})
+        params["pageSize"] = page_size
+
+        records, last_page = await self._fetch_page(endpoint, params, 1, strict)
+        for record in records:
+            yield record
+        if len(records) < page_size:
+            return
+
+        if last_page is not None and last_page < 2:
+            return
+
+        next_page = 2
+        pending = []
+        try:
+            while True:
+                while len(pending) < prefetch and (last_page is None or next_page <= last_page):
+                    pending.append(asyncio.ensure_future(self._fetch_page(endpoint, params, next_page, strict)))
+                    next_page += 1
+                if not pending:
+                    break
+                records, _ = await pending.pop(0)
+                for record in records:
+                    yield record
+                if len(records) < page_size:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _get_all(self, endpoint, params=None, page_size=MAX_PAGE_SIZE, strict=False):
+        """Fetch every page of a list endpoint and return the combined records."""
+        return [record async for record in self._iter(endpoint, params=params, page_size=page_size, strict=strict)]
+
+    def iter_tickets(self, conditions=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """Yield service tickets matching conditions across all pages."""
+        return self._iter("service/tickets", params=ConnectWiseClient._search_params(conditions, fields),
+                          page_size=page_size, strict=True)
+
+    async def get_tickets(self, conditions=None, page=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """Fetches service tickets; every page unless page is given."""
+        if page is None:
+            return [t async for t in self.iter_tickets(conditions, page_size=page_size, fields=fields)]
+        params = ConnectWiseClient._search_params(conditions, fields)
+        params.update({"pageSize": page_size, "page": page})
+        return await self._get("service/tickets", params=params)
+
+    def iter_project_tickets(self, conditions=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """Yield project tickets matching conditions across all pages."""
+        return self._iter("project/tickets", params=ConnectWiseClient._search_params(conditions, fields),
+                          page_size=page_size, strict=True)
+
+    async def iter_all_tickets(self, conditions=None, page_size=MAX_PAGE_SIZE, fields=None, date_range=None):
+        """
+        Yield service and project tickets as one stream, every search running concurrently.
+        date_range: Optional (start_date, end_date), inclusive, split into date shards.
+        """
+        searches = [(kind, shard_conditions)
+                    for shard_conditions, _ in search_shards(conditions, date_range, shard_unit())
+                    for kind in SEARCH_ENDPOINTS]
+        merged = asyncio.Queue(maxsize=page_size)
+
+        async def produce(kind, shard_conditions):
+            try:
+                params = ConnectWiseClient._search_params(shard_conditions, fields)
+                async for t in self._iter(SEARCH_ENDPOINTS[kind], params=params, page_size=page_size, strict=True):
+                    await merged.put((kind, t))
+                await merged.put((kind, None))
+            except Exception as exc:
+                await merged.put((kind, exc))
+
+        tasks = [asyncio.ensure_future(produce(kind, shard_conditions)) for kind, shard_conditions in searches]
+        seen = set()
+        remaining = len(tasks)
+        try:
+            while remaining:
+                kind, t = await merged.get()
+                if t is None:
+                    remaining -= 1
+                elif isinstance(t, Exception):
+                    raise t
+                elif merge_ticket(seen, kind, t) is not None:
+                    yield t
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_project_tickets(self, conditions=None, page=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """Fetches project tickets; every page unless page is given."""
+        if page is None:
+            return [t async for t in self.iter_project_tickets(conditions, page_size=page_size, fields=fields)]
+        params = ConnectWiseClient._search_params(conditions, fields)
+        params.update({"pageSize": page_size, "page": page})
+        return await self._get("project/tickets", params=params)
+
+    async def get_ticket_notes(self, ticket_id, member_id=None, last_updated=None, fields=None, ticket_type=None,
+                               date_range=None):
+        """Fetch ticket notes from the endpoint for its type, filtered server-side; cached per ticket version."""
+        endpoint, params, note_key = note_request(ticket_id, ticket_type, member_id, date_range, fields)
+        use_cache = self.cache is not None and last_updated
+        if use_cache:
+            notes = self.cache.get_notes(ticket_id, note_key, last_updated)
+            if notes is not None:
+                return notes
+
+        notes = await self._get_all(endpoint, params=params, strict=True)
+        if use_cache:
+            self.cache.put_notes(ticket_id, note_key, last_updated, notes)
+        return notes
+
+    async def get_ticket_time_entries(self, ticket_id, fields=None):
+        params = with_fields({"conditions": f"ticket/id={ticket_id}"}, fields)
+        return await self._get_all("time/entries", params=params)
+
+    async def get_time_entries(self, ticket_ids=None, member_id=None, start_date=None, end_date=None,
+                               chunk_size=TICKET_ID_CHUNK_SIZE, strict=False, fields=None):
+        """Fetch time entries in bulk; chunks are requested concurrently."""
+        chunks = await asyncio.gather(*[
+            self._get_all("time/entries", params=with_fields({"conditions": conditions}, fields), strict=strict)
+            for conditions in time_entry_conditions(ticket_ids, member_id, start_date, end_date, chunk_size)
+        ])
+        return [entry for chunk in chunks for entry in chunk]
+
+    async def get_time_totals(self, ticket_ids=None, member_id=None, start_date=None, end_date=None,
+                              versions=None):
+        """Return {ticket_id: hours} for a set of tickets (or a member/date window)."""
+        if ticket_ids is None:
+            entries = await self.get_time_entries(member_id=member_id, start_date=start_date, end_date=end_date,
+                                                  strict=True, fields=TIME_ENTRY_FIELDS)
+            return group_hours_by_ticket(entries)
+
+        ticket_ids = list(ticket_ids)
+        use_cache = self.cache is not None and versions and not (member_id or start_date or end_date)
+        cached = self.cache.get_hours(versions) if use_cache else {}
+        missing_ids = [t_id for t_id in ticket_ids if t_id not in cached]
+
+        totals = {}
+        if missing_ids:
+            entries = await self.get_time_entries(ticket_ids=missing_ids, member_id=member_id,
+                                                  start_date=start_date, end_date=end_date, strict=True,
+                                                  fields=TIME_ENTRY_FIELDS)
+            totals = group_hours_by_ticket(entries, missing_ids)
+            if use_cache:
+                self.cache.put_hours(versions, totals)
+        totals.update(cached)
+        return totals
+
+    async def get_total_time_for_ticket(self, ticket_id):
+        entries = await self.get_ticket_time_entries(ticket_id, fields="actualHours")
+        return sum(entry.get('actualHours', 0) for entry in entries or [])
+
+    async def get_members(self, fields=None):
+        """Fetch list of active technicians/members (excludes API accounts); raises ConnectWiseError on failure."""
+        return await self._get_all("system/members", params=with_fields({
+            "conditions": "inactiveFlag=false AND licenseClass!=\"A\""
+        }, fields), strict=True)
+
+    async def fetch_ticket_details(self, tickets, member_id=None, note_fields=None, date_range=None):
+        """
+        Fetch notes for every ticket (from the endpoint for its ticketType) and their time totals in one fan-out.
+        Returns (notes_by_ticket, hours_by_ticket); a ticket whose notes failed maps to an exception,
+        and hours_by_ticket is the exception itself if the time totals failed.
+        """
+        ticket_ids = [t['id'] for t in tickets]
+        versions = {t['id']: ticket_last_updated(t) for t in tickets}
+        notes, hours = await asyncio.gather(
+            asyncio.gather(*[
+                self.get_ticket_notes(t['id'], member_id=member_id, last_updated=versions[t['id']], fields=note_fields,
+                                      ticket_type=t.get('ticketType'), date_range=date_range)
+                for t in tickets
+            ], return_exceptions=True),
+            self.get_time_totals(ticket_ids=ticket_ids, versions=versions),
+            return_exceptions=True,
+        )
+        return dict(zip(ticket_ids, notes)), hours
+
+
+class AsyncClientAdapter:
+    """
+    Thin synchronous adapter over AsyncConnectWiseClient.
+    The client lives on a private event-loop thread, so its connection pool is
+    reused across calls, and any number of request threads can call the
+    coroutine methods as plain blocking functions.
+    """
+
+    def __init__(self, scheduler=None, max_concurrency=None, cache=None, single_flight=None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="cw-async-loop", daemon=True)
+        self._thread.start()
+        self.client = self._run(self._create(scheduler, max_concurrency, cache, single_flight))
+
+    @staticmethod
+    async def _create(scheduler, max_concurrency, cache, single_flight):
+        return AsyncConnectWiseClient(scheduler=scheduler, max_concurrency=max_concurrency, cache=cache,
+                                      single_flight=single_flight)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if inspect.iscoroutinefunction(attr):
+            return lambda *args, **kwargs: self._run(attr(*args, **kwargs))
+        if name.startswith("iter_"):
+            # Async generators are drained on the loop and returned as lists
+            async def collect(*args, **kwargs):
+                return [item async for item in attr(*args, **kwargs)]
+            return lambda *args, **kwargs: self._run(collect(*args, **kwargs))
+        return attr
+
+    def close(self):
+        self._run(self.client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
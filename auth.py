@@ -7,9 +7,11 @@ with their organizational account.
 """
 
 import os
+import threading
 from functools import wraps
 from flask import Blueprint, redirect, url_for, session, request, current_app
 import msal
+import requests
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -20,6 +22,17 @@ CLIENT_SECRET = None
 REDIRECT_PATH = "/auth/callback"
 SCOPE = ["User.Read"]
 
+# id token claims kept in a cookie session (SESSION_BACKEND=cookie), which must stay small
+COOKIE_USER_CLAIMS = ("name", "preferred_username", "oid", "tid")
+
+# Authority discovery and tenant metadata responses, shared by every MSAL app in the
+# process so a per-user app does not repeat them; requests go over one pooled session
+_msal_http_cache = {}
+_msal_http_client = requests.Session()
+# The token-cache-less app used for authorization URLs, built once
+_msal_app = None
+_msal_app_lock = threading.Lock()
+
 
 def init_auth(app):
     """Initialize authentication configuration."""
@@ -41,15 +54,35 @@ def init_auth(app):
 
 
 def _build_msal_app(cache=None):
-    """Build MSAL confidential client application."""
+    """
+    Build MSAL confidential client application.
+    Without a (per-user) token cache the process-wide app is returned instead.
+    """
+    global _msal_app
+    if cache is None:
+        with _msal_app_lock:
+            if _msal_app is None:
+                _msal_app = _new_msal_app(None)
+            return _msal_app
+    return _new_msal_app(cache)
+
+
+def _new_msal_app(cache):
     return msal.ConfidentialClientApplication(
         CLIENT_ID,
         authority=AUTHORITY,
         client_credential=CLIENT_SECRET,
-        token_cache=cache
+        token_cache=cache,
+        http_client=_msal_http_client,
+        http_cache=_msal_http_cache
     )
 
 
+def _cookie_sessions():
+    """Whether sessions are stored in the (size-limited) signed cookie."""
+    return current_app.config.get('SESSION_BACKEND') == 'cookie'
+
+
 def _build_auth_url(redirect_uri):
     """Build the authorization URL for login."""
     return _build_msal_app().get_authorization_request_url(
@@ -136,9 +169,13 @@ def callback():
     if "error" in result:
         return f"Token error: {result.get('error_description', 'Unknown error')}", 400
     
-    # Store user info in session
-    session["user"] = result.get("id_token_claims")
-    session["token_cache"] = cache.serialize()
+    # Store user info in session; a cookie session has no room for the token cache
+    claims = result.get("id_token_claims")
+    if _cookie_sessions():
+        session["user"] = {name: claims[name] for name in COOKIE_USER_CLAIMS if name in claims} if claims else None
+    else:
+        session["user"] = claims
+        session["token_cache"] = cache.serialize()
     
     # Redirect to original URL or home
     next_url = session.pop("next_url", None)
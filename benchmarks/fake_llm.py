@@ -0,0 +1,41 @@
+"""
+LLMProcessor stand-in that never calls a provider.
+
+Prompts are answered after a configurable latency (plus a per-token
+generation delay when streaming), so the prompt building, map-reduce
+batching and caching code paths run unchanged.
+"""
+
+import time
+from llm_processor import LLMProcessor
+
+
+class FakeLLMProcessor(LLMProcessor):
+    """LLMProcessor with a simulated provider; latency is seconds per call."""
+
+    def __init__(self, latency=0.5, tokens_per_second=200, response_tokens=400, **kwargs):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        kwargs.setdefault('provider', 'gemini')
+        kwargs.setdefault('model', 'fake')
+        super().__init__(**kwargs)
+
+    def _create_client(self, config):
+        return None
+
+    def _response(self, prompt):
+        return f"Fake report for a {self.estimate_tokens(prompt)}-token prompt. " + "word " * self.response_tokens
+
+    def _call_provider(self, prompt):
+        time.sleep(self.latency + self.response_tokens / self.tokens_per_second)
+        text = self._response(prompt)
+        self._count_tokens(prompt, text)
+        return text
+
+    def _call_provider_stream(self, prompt):
+        time.sleep(self.latency)
+        words = self._response(prompt).split(" ")
+        for i in range(0, len(words), 20):
+            time.sleep(20 / self.tokens_per_second)
+            yield " ".join(words[i:i + 20]) + " "
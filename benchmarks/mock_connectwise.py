@@ -0,0 +1,298 @@
+"""
+Local stand-in for the ConnectWise REST API, serving synthetic data.
+
+Tickets, notes and time entries are generated deterministically from a
+seed (notes lazily, per ticket), so a 10k-ticket run does not need 10k
+tickets' worth of notes in memory. Each response can be delayed by a
+configurable latency, and a fraction of requests can be answered with 429.
+Supports the endpoints, paging (with Link headers) and condition forms
+the client uses.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+API_ROOT = "/v4_6_release/apis/3.0/"
+
+MEMBERS = ["jsmith", "ajones", "mbrown", "lchen", "rpatel", "kgarcia", "dkim", "snguyen"]
+
+NOTE_TEMPLATES = [
+    "<p>Called the user and reproduced the issue.</p><br>Cleared the profile cache and the problem is resolved.",
+    "Applied the latest patches to the server and rebooted during the maintenance window.",
+    "Automated update: backup job completed successfully.",
+    "Replaced the failing switch in the server room; all ports verified.\n\nThanks,\nTechnician\nIT Services | 555-0100",
+    "Migrated the mailbox to the new tenant and confirmed mail flow.\n\n-----Original Message-----\nFrom: user\nSent: Monday\nIt is broken again",
+    "Documented the VPN setup steps in the knowledge base for the team.",
+    "> quoted customer reply\nCustomer confirmed the printer is working after the driver update.",
+]
+
+# Reference fields real ConnectWise objects carry, shared by every record so they
+# cost no memory per ticket but make full (unprojected) responses realistically large
+HREF_ROOT = "https://example.invalid" + API_ROOT.rstrip("/")
+TICKET_EXTRAS = {
+    'board': {'id': 1, 'name': "Service Desk", '_info': {'board_href': f"{HREF_ROOT}/service/boards/1"}},
+    'status': {'id': 6, 'name': "Closed", '_info': {'status_href': f"{HREF_ROOT}/service/boards/1/statuses/6"}},
+    'company': {'id': 250, 'identifier': "ExampleCo", 'name': "Example Company, Inc.",
+                '_info': {'company_href': f"{HREF_ROOT}/company/companies/250"}},
+    'contact': {'id': 42, 'name': "Pat Example", '_info': {'contact_href': f"{HREF_ROOT}/company/contacts/42"}},
+    'priority': {'id': 4, 'name': "Priority 3 - Normal Response", 'sort': 6},
+    'severity': "Medium", 'impact': "Medium", 'recordType': "ServiceTicket", 'billTime': "Billable",
+    'billExpenses': "Billable", 'billProducts': "Billable", 'approved': True, 'closedFlag': True,
+    'customerUpdatedFlag': False, 'automaticEmailContactFlag': False, 'allowAllClientsPortalView': False,
+}
+NOTE_EXTRAS = {
+    'detailDescriptionFlag': True, 'internalAnalysisFlag': False, 'resolutionFlag': False,
+    'issueFlag': False, 'externalFlag': False, 'createdBy': "Technician",
+}
+ENTRY_EXTRAS = {
+    'company': TICKET_EXTRAS['company'], 'chargeToType': 'ServiceTicket', 'billableOption': "Billable",
+    'workType': {'id': 1, 'name': "Remote Support"}, 'workRole': {'id': 2, 'name': "Technician"},
+    'timeStart': "2025-01-01T09:00:00Z", 'timeEnd': "2025-01-01T10:00:00Z", 'notes': "Worked on the ticket.",
+}
+
+_CONDITION_RES = {
+    'owner_in': re.compile(r'owner/identifier in \(([^)]*)\)', re.IGNORECASE),
+    'owner_eq': re.compile(r'owner/identifier\s*=\s*"([^"]*)"', re.IGNORECASE),
+    'ticket_in': re.compile(r'(?:ticket/)?id in \(([\d,\s]+)\)', re.IGNORECASE),
+    'updated_after': re.compile(r'lastUpdated > \[([^\]]+)\]', re.IGNORECASE),
+    'entered_from': re.compile(r'dateEntered >= \[([^\]]+)\]', re.IGNORECASE),
+    'entered_before': re.compile(r'dateEntered < \[([^\]]+)\]', re.IGNORECASE),
+    'entered_after': re.compile(r'dateEntered > \[([^\]]+)\]', re.IGNORECASE),
+    'created_from': re.compile(r'dateCreated >= \[([^\]]+)\]', re.IGNORECASE),
+    'created_before': re.compile(r'dateCreated < \[([^\]]+)\]', re.IGNORECASE),
+    'member_eq': re.compile(r'member/identifier\s*=\s*"([^"]*)"', re.IGNORECASE),
+}
+_TICKET_PATH_RE = re.compile(r"^(service|project)/tickets/(\d+)/(notes|allNotes)$")
+
+
+class MockConnectWise:
+    """
+    Synthetic ConnectWise server.
+    ticket_count: total tickets; project_ratio of them are project tickets.
+    latency/jitter: seconds added to every response (latency + uniform(0, jitter)).
+    throttle_rate: fraction of requests answered 429 with Retry-After: retry_after.
+    """
+
+    def __init__(self, ticket_count=1000, project_ratio=0.1, latency=0.05, jitter=0.02,
+                 throttle_rate=0.0, retry_after=1, notes_per_ticket=(1, 8), seed=42):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.notes_per_ticket = notes_per_ticket
+        self.seed = seed
+        self.request_count = 0
+        self.throttled_count = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+        project_count = int(ticket_count * project_ratio)
+        service_count = ticket_count - project_count
+        self.tickets = {
+            'service': [self._make_ticket(i) for i in range(1, service_count + 1)],
+            'project': [self._make_ticket(i) for i in range(service_count + 1, ticket_count + 1)],
+        }
+        self._kinds = {t['id']: kind for kind, tickets in self.tickets.items() for t in tickets}
+        self.entries = []
+        for kind in self.tickets.values():
+            for t in kind:
+                for _ in range(self._rng.randint(0, 3)):
+                    self.entries.append({
+                        'id': len(self.entries) + 1,
+                        'ticket': {'id': t['id']},
+                        'chargeToId': t['id'],
+                        'member': {'identifier': t['owner']['identifier']},
+                        'actualHours': self._rng.choice([0.25, 0.5, 1.0, 1.5, 2.0, 4.0]),
+                        **ENTRY_EXTRAS,
+                    })
+        self._server = None
+
+    def _make_ticket(self, ticket_id):
+        rng = self._rng
+        day = rng.randint(1, 28)
+        month = rng.randint(1, 12)
+        return {
+            'id': ticket_id,
+            'summary': f"Synthetic ticket {ticket_id}: {rng.choice(['VPN', 'Email', 'Printer', 'Server', 'Backup'])} issue",
+            'dateEntered': f"2025-{month:02d}-{day:02d}T09:00:00Z",
+            'dateClosed': f"2025-{month:02d}-{day:02d}T17:00:00Z",
+            'owner': {'identifier': rng.choice(MEMBERS)},
+            '_info': {'lastUpdated': f"2025-{month:02d}-{day:02d}T17:00:00Z"},
+            **TICKET_EXTRAS,
+        }
+
+    def ticket(self, ticket_id):
+        kind = self._kinds[ticket_id]
+        offset = 0 if kind == 'service' else len(self.tickets['service'])
+        return self.tickets[kind][ticket_id - offset - 1]
+
+    def notes_for(self, ticket_id):
+        """Notes are derived from the ticket id, so they never need to be stored; one per day from its entry."""
+        rng = random.Random(self.seed * 1000003 + ticket_id)
+        entered = date.fromisoformat(self.ticket(ticket_id)['dateEntered'][:10])
+        return [{
+            'id': ticket_id * 100 + i,
+            'text': rng.choice(NOTE_TEMPLATES),
+            'dateCreated': f"{(entered + timedelta(days=i)).isoformat()}T10:00:00Z",
+            'member': {'identifier': rng.choice(MEMBERS)},
+            **NOTE_EXTRAS,
+        } for i in range(rng.randint(*self.notes_per_ticket))]
+
+    # Server lifecycle
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                mock._handle(self)
+
+        ThreadingHTTPServer.request_queue_size = 1024
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-connectwise", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}{API_ROOT.rstrip('/')}"
+
+    # Request handling
+
+    def _handle(self, handler):
+        with self._lock:
+            self.request_count += 1
+            throttle = self.throttle_rate and self._rng.random() < self.throttle_rate
+            if throttle:
+                self.throttled_count += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+        time.sleep(delay)
+
+        if throttle:
+            handler.send_response(429)
+            handler.send_header("Retry-After", str(self.retry_after))
+            handler.end_headers()
+            return
+
+        url = urlparse(handler.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path[len(API_ROOT):] if url.path.startswith(API_ROOT) else url.path.lstrip("/")
+        data = self._records(path, query.get("conditions", ""))
+        if data is None:
+            handler.send_response(404)
+            handler.end_headers()
+            return
+
+        page_size = int(query.get("pageSize", 25))
+        page = int(query.get("page", 1))
+        records = data[(page - 1) * page_size: page * page_size]
+        if query.get("fields"):
+            records = [self._project(record, query["fields"].split(",")) for record in records]
+        body = json.dumps(records).encode("utf-8")
+        with self._lock:
+            self.bytes_sent += len(body)
+        last_page = max(1, -(-len(data) // page_size))
+        base = f"http://{handler.headers['Host']}{url.path}"
+        links = []
+        if page < last_page:
+            links.append(f'<{base}?page={page + 1}&pageSize={page_size}>; rel="next"')
+        links.append(f'<{base}?page={last_page}&pageSize={page_size}>; rel="last"')
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Link", ", ".join(links))
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _records(self, path, conditions):
+        if path in ("service/tickets", "project/tickets"):
+            return self._filter_tickets(self.tickets[path.split("/")[0]], conditions)
+
+        match = _TICKET_PATH_RE.match(path)
+        if match:
+            # Like ConnectWise, a ticket's notes are only found under its own type
+            if self._kinds.get(int(match.group(2))) != match.group(1):
+                return None
+            notes = self.notes_for(int(match.group(2)))
+            member = _CONDITION_RES['member_eq'].search(conditions)
+            if member:
+                notes = [n for n in notes if n['member']['identifier'] == member.group(1)]
+            for name, keep in (('created_from', lambda created, bound: created >= bound),
+                               ('created_before', lambda created, bound: created < bound)):
+                match = _CONDITION_RES[name].search(conditions)
+                if match:
+                    notes = [n for n in notes if keep(n['dateCreated'], match.group(1))]
+            return notes
+
+        if path == "time/entries":
+            ids = _CONDITION_RES['ticket_in'].search(conditions)
+            if ids:
+                wanted = {int(i) for i in ids.group(1).split(",")}
+                return [e for e in self.entries if e['ticket']['id'] in wanted]
+            return self.entries
+
+        if path == "system/members":
+            return [{'identifier': m, 'firstName': m[1:].title(), 'lastName': m[0].upper()} for m in MEMBERS]
+        return None
+
+    @staticmethod
+    def _project(record, fields):
+        """Keep only the requested fields; "owner/identifier" selects a nested one."""
+        projected = {}
+        for field in fields:
+            head, _, rest = field.strip().partition("/")
+            if head not in record:
+                continue
+            if rest and isinstance(record[head], dict):
+                nested = MockConnectWise._project(record[head], [rest])
+                projected.setdefault(head, {}).update(nested)
+            else:
+                projected[head] = record[head]
+        return projected
+
+    @staticmethod
+    def _filter_tickets(tickets, conditions):
+        owners = None
+        match = _CONDITION_RES['owner_in'].search(conditions)
+        if match:
+            owners = {o.strip().strip('"') for o in match.group(1).split(",")}
+        match = _CONDITION_RES['owner_eq'].search(conditions)
+        if match:
+            owners = {match.group(1)}
+        if owners is not None:
+            tickets = [t for t in tickets if t['owner']['identifier'] in owners]
+
+        match = _CONDITION_RES['ticket_in'].search(conditions)
+        if match:
+            wanted = {int(i) for i in match.group(1).split(",")}
+            tickets = [t for t in tickets if t['id'] in wanted]
+
+        match = _CONDITION_RES['updated_after'].search(conditions)
+        if match:
+            tickets = [t for t in tickets if t['_info']['lastUpdated'] > match.group(1)]
+
+        # Dates compare as strings: "2025-03-01" sorts before "2025-03-01T09:00:00Z"
+        for name, keep in (('entered_from', lambda entered, bound: entered >= bound),
+                           ('entered_before', lambda entered, bound: entered < bound),
+                           ('entered_after', lambda entered, bound: entered > bound)):
+            match = _CONDITION_RES[name].search(conditions)
+            if match:
+                tickets = [t for t in tickets if keep(t['dateEntered'], match.group(1))]
+        return tickets
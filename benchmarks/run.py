@@ -0,0 +1,186 @@
+"""
+Offline benchmark of the report pipeline against the mock ConnectWise server.
+
+    python -m benchmarks.run                          # 100/1k/10k tickets x concurrency 4/16/32
+    python -m benchmarks.run --tickets 1000 --concurrency 16 --latency 0.1 --throttle 0.02
+    python -m benchmarks.run --json after.json --baseline before.json
+
+Each scenario runs in a fresh process so peak memory is per scenario. The
+mock server runs in this process. Reported per scenario:
+- throughput (tickets/s)
+- p50/p99 ConnectWise request latency as seen by the client
+- peak RSS and response bytes sent by the mock server
+- pipeline stage timings
+- the fake LLM phase
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from benchmarks.mock_connectwise import MockConnectWise
+
+# A throughput drop larger than this against --baseline counts as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(base_url, concurrency, rate, llm_latency, use_async, results):
+    """Child process: run one search -> details -> LLM report and report measurements."""
+    os.environ.update({
+        "CW_BASE_URL": base_url,
+        "CW_COMPANY_ID": "bench", "CW_SITE_URL": "localhost", "CW_PUBLIC_KEY": "bench", "CW_PRIVATE_KEY": "bench",
+        # Measure cold runs: no ticket or LLM response cache
+        "CW_CACHE_PATH": "off", "LLM_CACHE_PATH": "off",
+    })
+    from connectwise_client import ConnectWiseClient
+    from request_scheduler import RequestScheduler
+    from note_preprocessing import NotePreprocessor
+    from ticket_pipeline import TicketPipeline
+    from benchmarks.fake_llm import FakeLLMProcessor
+
+    cw = ConnectWiseClient(scheduler=RequestScheduler(rate=rate, burst=rate, max_concurrency=concurrency))
+    latencies = []
+    cw.session.hooks['response'].append(lambda response, *args, **kwargs: latencies.append(
+        response.elapsed.total_seconds()
+    ))
+
+    async_client = None
+    if use_async:
+        from async_connectwise_client import AsyncClientAdapter
+        async_client = AsyncClientAdapter(scheduler=cw.scheduler, max_concurrency=concurrency)
+        http = async_client.client.client
+        send = http.get
+
+        async def timed_get(*args, **kwargs):
+            response = await send(*args, **kwargs)
+            latencies.append(response.elapsed.total_seconds())
+            return response
+        http.get = timed_get
+
+    started = time.perf_counter()
+    pipeline = TicketPipeline(cw, preprocessor=NotePreprocessor(), async_client=async_client)
+    # An annual review: searched in monthly shards unless CW_SEARCH_SHARD says otherwise
+    records = pipeline.collect(None, date_range=("2025-01-01", "2025-12-31"))
+    collect_seconds = time.perf_counter() - started
+
+    llm_started = time.perf_counter()
+    FakeLLMProcessor(latency=llm_latency, use_cache=False).summarize_quarterly_work(records, "Benchmark")
+    llm_seconds = time.perf_counter() - llm_started
+    total_seconds = time.perf_counter() - started
+
+    if async_client is not None:
+        async_client.close()
+
+    stats = pipeline.stats()
+    results.put({
+        'tickets': stats['ticket_count'],
+        'failed': stats['failed_count'],
+        'collect_seconds': round(collect_seconds, 3),
+        'llm_seconds': round(llm_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'tickets_per_second': round(stats['ticket_count'] / collect_seconds, 1) if collect_seconds else 0.0,
+        'client_requests': len(latencies),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'stage_seconds': stats['stage_seconds'],
+    })
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline against a mock ConnectWise server.")
+    parser.add_argument("--tickets", default="100,1000,10000", help="Comma-separated ticket counts")
+    parser.add_argument("--concurrency", default="4,16,32", help="Comma-separated CW_MAX_CONCURRENCY values")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Client rate limit in requests/second")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server latency per request (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Extra random latency per request (seconds)")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake LLM latency per call (seconds)")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio client for details")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare throughput against a previous --json file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    context = multiprocessing.get_context("spawn")
+    rows = []
+
+    for ticket_count in [int(n) for n in args.tickets.split(",")]:
+        mock = MockConnectWise(ticket_count=ticket_count, latency=args.latency, jitter=args.jitter,
+                               throttle_rate=args.throttle).start()
+        try:
+            for concurrency in [int(n) for n in args.concurrency.split(",")]:
+                requests_before = mock.request_count
+                throttled_before = mock.throttled_count
+                bytes_before = mock.bytes_sent
+                results = context.Queue()
+                process = context.Process(target=run_scenario, args=(
+                    mock.base_url, concurrency, args.rate, args.llm_latency, args.use_async, results
+                ))
+                process.start()
+                while True:
+                    try:
+                        result = results.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not process.is_alive():
+                            raise RuntimeError(f"Scenario process failed with exit code {process.exitcode}")
+                process.join()
+                row = dict({'scenario': f"{ticket_count} tickets / concurrency {concurrency}",
+                            'ticket_count': ticket_count, 'concurrency': concurrency,
+                            'server_requests': mock.request_count - requests_before,
+                            'throttled': mock.throttled_count - throttled_before,
+                            'server_mb': round((mock.bytes_sent - bytes_before) / 1e6, 2)}, **result)
+                rows.append(row)
+                print(f"{row['scenario']:<36} {row['tickets_per_second']:>8.1f} tickets/s  "
+                      f"collect {row['collect_seconds']:>7.2f}s  llm {row['llm_seconds']:>6.2f}s  "
+                      f"p50 {row['p50_ms']:>6.1f}ms  p99 {row['p99_ms']:>7.1f}ms  "
+                      f"rss {row['peak_rss_mb']:>6.1f}MB  sent {row['server_mb']:>6.2f}MB  "
+                      f"requests {row['server_requests']} "
+                      f"(429s {row['throttled']})", flush=True)
+        finally:
+            mock.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = {row['scenario']: row for row in json.load(f)}
+        regressions = 0
+        for row in rows:
+            before = baseline.get(row['scenario'])
+            if not before or not before['tickets_per_second']:
+                continue
+            change = row['tickets_per_second'] / before['tickets_per_second'] - 1
+            flag = "REGRESSION" if change < -REGRESSION_THRESHOLD else ""
+            regressions += bool(flag)
+            print(f"{row['scenario']:<36} {before['tickets_per_second']:>8.1f} -> "
+                  f"{row['tickets_per_second']:>8.1f} tickets/s ({change:+.0%}) {flag}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
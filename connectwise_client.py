@@ -3,102 +3,509 @@ import requests.adapters
 import base64
 import os
 import json
+import queue
+import threading
+import collections
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+import metrics
+from date_shards import date_window, parse_date, search_shards, shard_unit
+from request_scheduler import RequestScheduler
+from single_flight import SingleFlight, request_key
+from ticket_cache import TicketCache
+
+# ConnectWise caps pageSize at 1000
+MAX_PAGE_SIZE = 1000
+# Pages fetched ahead of the consumer while paginating
+PAGE_PREFETCH = 4
+# Keep "ticket/id in (...)" conditions well below URL length limits
+TICKET_ID_CHUNK_SIZE = 100
+# Seconds to wait for ConnectWise to connect/respond before retrying
+REQUEST_TIMEOUT = 60
+# Tickets written to / read from the ticket cache per statement during a search
+CACHE_CHUNK_SIZE = 500
+
+# Ticket search endpoint per ticketType
+SEARCH_ENDPOINTS = {'service': "service/tickets", 'project': "project/tickets"}
+
+# Minimal field sets (the API's `fields` parameter) for what the report pipeline reads
+TICKET_FIELDS = "id,summary,dateEntered,dateClosed,owner/identifier,_info/lastUpdated"
+NOTE_FIELDS = "id,text,dateCreated"
+TIME_ENTRY_FIELDS = "ticket/id,chargeToId,actualHours"
+MEMBER_FIELDS = "identifier,firstName,lastName"
+
+
+def merge_ticket(seen, kind, t):
+    """
+    Tag a ticket from a merged search with its ticketType ('service' or 'project').
+    Returns None for a ticket already seen (ids are unique across both types, and
+    paging can repeat a ticket that moved while the search ran).
+    """
+    if t['id'] in seen:
+        return None
+    seen.add(t['id'])
+    t['ticketType'] = kind
+    return t
+
+
+def with_fields(params, fields):
+    """Add a `fields` projection to request params; None keeps the full objects."""
+    if fields:
+        params["fields"] = fields
+    return params
+
+
+def note_request(ticket_id, ticket_type=None, member_id=None, date_range=None, fields=None):
+    """
+    Build (endpoint, params, cache_key) for one ticket's notes.
+    The endpoint follows the ticket's type (service unless given), so project tickets
+    are not asked for at service/tickets. allNotes returns ticket, time entry and email
+    notes in one list (CW_ALL_NOTES=off uses the plain notes endpoints). The member and
+    date_range (dateCreated, both ends inclusive) filters are applied by ConnectWise.
+    """
+    kind = ticket_type or 'service'
+    if kind not in SEARCH_ENDPOINTS:
+        raise ValueError(f"Unknown ticketType: {kind}. Supported: {list(SEARCH_ENDPOINTS)}")
+    suffix = "notes" if os.getenv("CW_ALL_NOTES", "on").lower() == "off" else "allNotes"
+
+    conditions = []
+    if member_id:
+        conditions.append(f'member/identifier="{member_id}"')
+    if date_range is not None:
+        stop = parse_date(date_range[1]) + timedelta(days=1)
+        conditions.append(date_window(parse_date(date_range[0]), stop, field='dateCreated'))
+    params = with_fields({}, fields)
+    if conditions:
+        params["conditions"] = " AND ".join(conditions)
+    cache_key = f"{kind}/{suffix}?{params.get('conditions', '')}"
+    return f"{SEARCH_ENDPOINTS[kind]}/{ticket_id}/{suffix}", params, cache_key
 
-class ConnectWiseClient:
-    def __init__(self):
-        self.company_id = os.getenv("CW_COMPANY_ID")
-        self.site_url = os.getenv("CW_SITE_URL")
-        self.public_key = os.getenv("CW_PUBLIC_KEY")
-        self.private_key = os.getenv("CW_PRIVATE_KEY")
-        self.client_id = os.getenv("CW_CLIENT_ID")
 
-        if not all([self.company_id, self.site_url, self.public_key, self.private_key]):
-            raise ValueError("Missing ConnectWise credentials in environment variables.")
+def time_entry_conditions(ticket_ids=None, member_id=None, start_date=None, end_date=None,
+                          chunk_size=TICKET_ID_CHUNK_SIZE):
+    """Build the time/entries conditions for a chunked ticket set or a member/date window."""
+    window = []
+    if member_id:
+        window.append(f'member/identifier="{member_id}"')
+    if start_date:
+        window.append(f"timeStart >= [{start_date}]")
+    if end_date:
+        window.append(f"timeStart <= [{end_date}]")
+    window_conditions = " AND ".join(window)
 
-        self.base_url = f"https://{self.site_url}/v4_6_release/apis/3.0"
+    if ticket_ids is None:
+        if not window_conditions:
+            raise ValueError("Time entry queries need ticket_ids or a member/date window.")
+        return [window_conditions]
+
+    ids = list(dict.fromkeys(ticket_ids))
+    conditions = []
+    for i in range(0, len(ids), chunk_size):
+        chunk = ",".join(str(t_id) for t_id in ids[i:i + chunk_size])
+        chunk_conditions = f"ticket/id in ({chunk})"
+        if window_conditions:
+            chunk_conditions = f"({chunk_conditions}) AND {window_conditions}"
+        conditions.append(chunk_conditions)
+    return conditions
+
+
+def group_hours_by_ticket(entries, ticket_ids=None):
+    """Sum actualHours per ticket; every requested ticket id gets an entry."""
+    totals = {}
+    if ticket_ids is not None:
+        totals = {t_id: 0.0 for t_id in ticket_ids}
+    for entry in entries:
+        t_id = (entry.get('ticket') or {}).get('id') or entry.get('chargeToId')
+        if t_id is None:
+            continue
+        totals[t_id] = totals.get(t_id, 0.0) + (entry.get('actualHours') or 0)
+    return totals
+
+
+class ConnectWiseError(Exception):
+    """Raised when a request fails and a partial result would be wrong (e.g. before caching it)."""
+
+
+def connectwise_settings():
+    """Read ConnectWise credentials from the environment; returns (base_url, headers)."""
+    company_id = os.getenv("CW_COMPANY_ID")
+    site_url = os.getenv("CW_SITE_URL")
+    public_key = os.getenv("CW_PUBLIC_KEY")
+    private_key = os.getenv("CW_PRIVATE_KEY")
+    client_id = os.getenv("CW_CLIENT_ID")
+
+    if not all([company_id, site_url, public_key, private_key]):
+        raise ValueError("Missing ConnectWise credentials in environment variables.")
+
+    # CW_BASE_URL points the client at another API root (e.g. the benchmark's mock server)
+    base_url = os.getenv("CW_BASE_URL") or f"https://{site_url}/v4_6_release/apis/3.0"
+    
+    # Prepare Auth Header
+    user_pass = f"{company_id}+{public_key}:{private_key}"
+    encoded_auth = base64.b64encode(user_pass.encode()).decode()
+    
+    headers = {
+        "Authorization": f"Basic {encoded_auth}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+    if client_id:
+        headers["clientId"] = client_id
+    return base_url, headers
+
+
+class ConnectWiseClient:
+    def __init__(self, scheduler=None, cache=None, single_flight=None):
+        self.base_url, headers = connectwise_settings()
+        
+        # Persistent ticket/notes/time cache (CW_CACHE_PATH; "off" disables it)
+        self.cache = cache if cache is not None else TicketCache.from_env()
+        
+        # Every request is paced, limited and retried by one shared scheduler
+        self.scheduler = scheduler or RequestScheduler()
+        
+        # Identical concurrent GETs (e.g. from overlapping reports) share one request
+        self.single_flight = single_flight or SingleFlight()
         
-        # Prepare Auth Header
-        user_pass = f"{self.company_id}+{self.public_key}:{self.private_key}"
-        encoded_auth = base64.b64encode(user_pass.encode()).decode()
+        # Ticket searches (one per type and date shard) run at most this many at a time
+        self.search_workers = int(os.getenv("CW_SEARCH_WORKERS", "4"))
         
         # Use a Session for connection pooling
         self.session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20)
+        pool_size = max(20, self.scheduler.max_concurrency)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
         self.session.mount("https://", adapter)
-        
-        self.session.headers.update({
-            "Authorization": f"Basic {encoded_auth}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        })
-        if self.client_id:
-            self.session.headers["clientId"] = self.client_id
+        self.session.headers.update(headers)
 
-    def _get(self, endpoint, params=None):
+    def _request(self, endpoint, params=None):
+        """Issue a GET and return the raw response, or None on HTTP errors."""
         url = f"{self.base_url}/{endpoint}"
+        label = metrics.endpoint_label(endpoint)
         try:
-            response = self.session.get(url, params=params)
+            with metrics.span('connectwise_request_seconds', endpoint=label):
+                response = self.scheduler.execute(
+                    lambda: self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+                )
             response.raise_for_status()
-            return response.json()
+            return response
         except requests.exceptions.HTTPError as e:
+            metrics.count('connectwise_request_errors_total', endpoint=label)
             print(f"Error fetching {url}: {e}")
             if response.text:
                 print(f"Response: {response.text}")
             return None
+        except requests.exceptions.RequestException as e:
+            metrics.count('connectwise_request_errors_total', endpoint=label)
+            print(f"Error fetching {url}: {e}")
+            return None
 
-    def get_tickets(self, conditions=None, page=1, page_size=25):
+    def _get_json(self, endpoint, params=None):
         """
-        Fetches service tickets based on conditions.
-        conditions: String for CW SQL-like query e.g. "dateEntered > [2024-01-01]"
+        GET and parse a response; returns (data, last_page) or None on HTTP errors.
+        Identical concurrent calls share one request and its (read-only) result.
+        """
+        def fetch():
+            response = self._request(endpoint, params=params)
+            if response is None:
+                return None
+            return response.json(), self._last_page(response)
+        return self.single_flight.do(request_key(endpoint, params), fetch)
+
+    def _get(self, endpoint, params=None):
+        result = self._get_json(endpoint, params=params)
+        if result is None:
+            return None
+        return result[0]
+
+    def _fetch_page(self, endpoint, params, page, strict=False):
+        """Fetch a single page; returns (records, last_page from the Link header or None)."""
+        page_params = dict(params)
+        page_params["page"] = page
+        result = self._get_json(endpoint, params=page_params)
+        if result is None:
+            if strict:
+                raise ConnectWiseError(f"Failed to fetch page {page} of {endpoint}")
+            return [], None
+        records, last_page = result
+        return records or [], last_page
+
+    @staticmethod
+    def _last_page(response):
+        """Read the last page number from the Link header, if ConnectWise sent one."""
+        if response is None:
+            return None
+        last_url = response.links.get("last", {}).get("url")
+        if not last_url:
+            return None
+        query = parse_qs(urlparse(last_url).query)
+        page = query.get("page") or query.get("Page")
+        try:
+            return int(page[0])
+        except (TypeError, ValueError):
+            return None
+
+    def _iter(self, endpoint, params=None, page_size=MAX_PAGE_SIZE, prefetch=PAGE_PREFETCH, strict=False):
+        """
+        Yield every record of a list endpoint, page by page.
+        After the first page, pages N+1..N+prefetch are fetched concurrently over the
+        pooled session, while records are yielded in order as soon as each page lands.
+        strict: Raise ConnectWiseError on a failed page instead of stopping early.
         """
-        params = {
-            "pageSize": page_size,
-            "page": page,
-            "orderBy": "dateEntered desc" 
-        }
+        params = dict(params or {})
+        params["pageSize"] = page_size
+
+        records, last_page = self._fetch_page(endpoint, params, 1, strict)
+        yield from records
+        if len(records) < page_size:
+            return
+
+        if last_page is not None and last_page < 2:
+            return
+
+        next_page = 2
+        pending = collections.deque()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            while True:
+                # Keep the prefetch window full; without a Link header we fetch speculatively
+                while len(pending) < prefetch and (last_page is None or next_page <= last_page):
+                    pending.append(executor.submit(metrics.bind(self._fetch_page), endpoint, params, next_page, strict))
+                    next_page += 1
+                if not pending:
+                    break
+                records, _ = pending.popleft().result()
+                yield from records
+                if len(records) < page_size:
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_all(self, endpoint, params=None, page_size=MAX_PAGE_SIZE, strict=False):
+        """Fetch every page of a list endpoint and return the combined records."""
+        return list(self._iter(endpoint, params=params, page_size=page_size, strict=strict))
+
+    @staticmethod
+    def _search_params(conditions, fields=None):
+        params = {"orderBy": "dateEntered desc"}
         if conditions:
             params["conditions"] = conditions
-            
+        return with_fields(params, fields)
+
+    def _iter_search(self, endpoint, kind, conditions, page_size, fields=None, closed=False, cache_query=True):
+        """
+        Yield the tickets matching conditions. With a cache, a query seen before only
+        asks ConnectWise for tickets updated since its last sync and serves the rest from disk.
+        closed: The query covers a past date shard, so its cached ids are trusted for longer.
+        cache_query: False for one-off conditions (e.g. a delta report's high-water mark) that
+        would only add query rows no later search reuses.
+        A page that fails after retries raises ConnectWiseError rather than ending the search early.
+        """
+        params = self._search_params(conditions, fields)
+        if self.cache is None or not cache_query:
+            yield from self._iter(endpoint, params=params, page_size=page_size, strict=True)
+            return
+
+        query_key = f"{endpoint}?{conditions or ''}"
+        if fields:
+            query_key += f"&fields={fields}"
+        started_at = datetime.now(timezone.utc)
+        cached = self.cache.get_query(query_key, self.cache.closed_query_ttl if closed else None)
+        if cached:
+            synced_at, cached_ids = cached
+            delta = f"lastUpdated > [{synced_at}]"
+            params["conditions"] = f"({conditions}) AND {delta}" if conditions else delta
+
+        # Write changed tickets through in chunks and keep only their ids, so a
+        # large search never holds every raw payload at once
+        ticket_ids = []
+        changed = []
+        for t in self._iter(endpoint, params=params, page_size=page_size, strict=True):
+            ticket_ids.append(t['id'])
+            changed.append(t)
+            if len(changed) >= CACHE_CHUNK_SIZE:
+                self.cache.put_tickets(kind, changed)
+                changed = []
+            yield t
+        self.cache.put_tickets(kind, changed)
+
+        if cached:
+            changed_ids = set(ticket_ids)
+            unchanged_ids = [t_id for t_id in cached_ids if t_id not in changed_ids]
+            for i in range(0, len(unchanged_ids), CACHE_CHUNK_SIZE):
+                yield from self.cache.get_tickets(kind, unchanged_ids[i:i + CACHE_CHUNK_SIZE])
+            ticket_ids.extend(unchanged_ids)
+        self.cache.save_query(query_key, kind, started_at, ticket_ids)
+
+    def iter_tickets(self, conditions=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """Yield service tickets matching conditions across all pages."""
+        return self._iter_search("service/tickets", "service", conditions, page_size, fields)
+
+    def get_tickets(self, conditions=None, page=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """
+        Fetches service tickets based on conditions.
+        conditions: String for CW SQL-like query e.g. "dateEntered > [2024-01-01]"
+        page: Fetch only this page; by default every page is fetched.
+        fields: Comma-separated fields to return (e.g. TICKET_FIELDS); by default full tickets.
+        """
+        if page is None:
+            return list(self.iter_tickets(conditions, page_size=page_size, fields=fields))
+        params = self._search_params(conditions, fields)
+        params.update({"pageSize": page_size, "page": page})
         return self._get("service/tickets", params=params)
 
-    def get_project_tickets(self, conditions=None, page=1, page_size=25):
+    def iter_project_tickets(self, conditions=None, page_size=MAX_PAGE_SIZE, fields=None):
+        """Yield project tickets matching conditions across all pages."""
+        return self._iter_search("project/tickets", "project", conditions, page_size, fields)
+
+    def iter_all_tickets(self, conditions=None, page_size=MAX_PAGE_SIZE, fields=None, date_range=None,
+                         cache_query=True):
+        """
+        Yield service and project tickets matching conditions as one stream.
+        date_range: Optional (start_date, end_date), inclusive; long ranges are split into
+        month/week shards (CW_SEARCH_SHARD), each searched and cached as its own query.
+        cache_query: False searches without the query cache (see _iter_search).
+        Every search runs concurrently (up to CW_SEARCH_WORKERS at a time), and tickets are
+        yielded as soon as any search produces them, tagged by merge_ticket and de-duplicated.
+        """
+        searches = [(kind, shard_conditions, closed)
+                    for shard_conditions, closed in search_shards(conditions, date_range, shard_unit())
+                    for kind in SEARCH_ENDPOINTS]
+        merged = queue.Queue(maxsize=page_size)
+        stop = threading.Event()
+
+        def offer(item):
+            # Give up once the consumer has stopped, so producers never block forever
+            while not stop.is_set():
+                try:
+                    merged.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(kind, shard_conditions, closed):
+            try:
+                for t in self._iter_search(SEARCH_ENDPOINTS[kind], kind, shard_conditions, page_size, fields,
+                                           closed, cache_query):
+                    if not offer((kind, t)):
+                        return
+                offer((kind, None))
+            except Exception as exc:
+                offer((kind, exc))
+
+        workers = max(1, min(self.search_workers, len(searches)))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cw-search")
+        for search in searches:
+            executor.submit(metrics.bind(produce), *search)
+
+        seen = set()
+        remaining = len(searches)
+        try:
+            while remaining:
+                kind, t = merged.get()
+                if t is None:
+                    remaining -= 1
+                elif isinstance(t, Exception):
+                    raise t
+                elif merge_ticket(seen, kind, t) is not None:
+                    yield t
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_project_tickets(self, conditions=None, page=None, page_size=MAX_PAGE_SIZE, fields=None):
         """
         Fetches project tickets based on conditions.
+        page: Fetch only this page; by default every page is fetched.
         """
-        params = {
-            "pageSize": page_size,
-            "page": page,
-            "orderBy": "dateEntered desc" 
-        }
-        if conditions:
-            params["conditions"] = conditions
-            
+        if page is None:
+            return list(self.iter_project_tickets(conditions, page_size=page_size, fields=fields))
+        params = self._search_params(conditions, fields)
+        params.update({"pageSize": page_size, "page": page})
         return self._get("project/tickets", params=params)
 
-    def get_ticket_notes(self, ticket_id, member_id=None):
-        """Fetch ticket notes, optionally filtered by member."""
-        params = {}
-        if member_id:
-            params["conditions"] = f'member/identifier="{member_id}"'
-        return self._get(f"service/tickets/{ticket_id}/notes", params=params)
+    def get_ticket_notes(self, ticket_id, member_id=None, last_updated=None, fields=None, ticket_type=None,
+                         date_range=None):
+        """
+        Fetch ticket notes, optionally filtered by member and creation date (see note_request).
+        last_updated: The ticket's _info.lastUpdated; when given, notes are served from
+        and stored in the cache under that version.
+        fields: Comma-separated note fields to return (e.g. NOTE_FIELDS).
+        ticket_type: 'service' (default) or 'project', as tagged by iter_all_tickets.
+        """
+        endpoint, params, note_key = note_request(ticket_id, ticket_type, member_id, date_range, fields)
+        use_cache = self.cache is not None and last_updated
+        if use_cache:
+            notes = self.cache.get_notes(ticket_id, note_key, last_updated)
+            if notes is not None:
+                return notes
+
+        # Partial notes would be reported as complete; a failed page fails the ticket instead
+        notes = self._get_all(endpoint, params=params, strict=True)
+        if use_cache:
+            self.cache.put_notes(ticket_id, note_key, last_updated, notes)
+        return notes
 
-    def get_ticket_time_entries(self, ticket_id):
+    def get_ticket_time_entries(self, ticket_id, fields=None):
         # Filter time entries by ticketId
         conditions = f"ticket/id={ticket_id}"
-        return self._get("time/entries", params={"conditions": conditions})
+        return self._get_all("time/entries", params=with_fields({"conditions": conditions}, fields))
+
+    def get_time_entries(self, ticket_ids=None, member_id=None, start_date=None, end_date=None,
+                         chunk_size=TICKET_ID_CHUNK_SIZE, strict=False, fields=None):
+        """
+        Fetch time entries in bulk instead of one call per ticket.
+        ticket_ids: Iterable of ticket ids, queried in chunks with "ticket/id in (...)"
+        member_id/start_date/end_date: Alternatively, every entry for a member and/or date window
+        fields: Comma-separated entry fields to return; by default full entries.
+        """
+        entries = []
+        for conditions in time_entry_conditions(ticket_ids, member_id, start_date, end_date, chunk_size):
+            params = with_fields({"conditions": conditions}, fields)
+            entries.extend(self._get_all("time/entries", params=params, strict=strict))
+        return entries
+
+    def get_time_totals(self, ticket_ids=None, member_id=None, start_date=None, end_date=None, versions=None):
+        """
+        Return {ticket_id: hours} for a set of tickets (or a member/date window),
+        grouping bulk-fetched time entries in memory.
+        versions: Optional {ticket_id: lastUpdated}; tickets whose totals are cached
+        under the same version are not re-fetched.
+        A failed chunk raises ConnectWiseError instead of counting its tickets as 0 hours.
+        """
+        if ticket_ids is None:
+            entries = self.get_time_entries(member_id=member_id, start_date=start_date, end_date=end_date,
+                                            strict=True, fields=TIME_ENTRY_FIELDS)
+            return group_hours_by_ticket(entries)
+
+        ticket_ids = list(ticket_ids)
+        use_cache = self.cache is not None and versions and not (member_id or start_date or end_date)
+        cached = self.cache.get_hours(versions) if use_cache else {}
+        missing_ids = [t_id for t_id in ticket_ids if t_id not in cached]
+
+        totals = {}
+        if missing_ids:
+            entries = self.get_time_entries(ticket_ids=missing_ids, member_id=member_id,
+                                            start_date=start_date, end_date=end_date, strict=True,
+                                            fields=TIME_ENTRY_FIELDS)
+            totals = group_hours_by_ticket(entries, missing_ids)
+            if use_cache:
+                self.cache.put_hours(versions, totals)
+        totals.update(cached)
+        return totals
 
     def get_total_time_for_ticket(self, ticket_id):
-        entries = self.get_ticket_time_entries(ticket_id)
+        entries = self.get_ticket_time_entries(ticket_id, fields="actualHours")
         if not entries:
             return 0.0
         
         total_hours = sum(entry.get('actualHours', 0) for entry in entries)
         return total_hours
     
-    def get_members(self):
-        """Fetch list of active technicians/members (excludes API accounts)."""
-        return self._get("system/members", params={
-            "conditions": "inactiveFlag=false AND licenseClass!=\"A\"",
-            "pageSize": 1000
-        })
+    def get_members(self, fields=None):
+        """Fetch list of active technicians/members (excludes API accounts); raises ConnectWiseError on failure."""
+        return self._get_all("system/members", params=with_fields({
+            "conditions": "inactiveFlag=false AND licenseClass!=\"A\""
+        }, fields), strict=True)
 
@@ -0,0 +1,83 @@
+"""
+Split a review period into calendar-aligned dateEntered shards.
+
+A long range searched as one query is slow and its result cannot be
+reused by any other report. Split on month (or week) boundaries instead,
+and every shard is a small query that can run in parallel and is cached on
+its own: the July shard of a Q3 report is the same query as the July shard
+of the annual report. A shard that ended before today is closed - no new
+ticket can be entered in it - so its cached result is trusted for longer.
+"""
+
+import os
+from datetime import date, timedelta
+
+SHARD_UNITS = ('month', 'week')
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string (or pass a date through); raises ValueError otherwise."""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+def shard_unit():
+    """The configured shard unit (CW_SEARCH_SHARD: month, week or off); None when off."""
+    unit = os.getenv("CW_SEARCH_SHARD", "month").lower()
+    if unit == "off":
+        return None
+    if unit not in SHARD_UNITS:
+        raise ValueError(f"Unknown CW_SEARCH_SHARD: {unit}. Supported: month, week, off")
+    return unit
+
+
+def _next_boundary(day, unit):
+    if unit == 'week':
+        return day + timedelta(days=7 - day.weekday())
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
+
+
+def date_shards(start_date, end_date, unit='month'):
+    """
+    Return [(start, stop)] covering start_date..end_date inclusive, split on
+    month/week boundaries; stop is exclusive. unit=None returns the whole range.
+    """
+    start = parse_date(start_date)
+    stop = parse_date(end_date) + timedelta(days=1)
+    if stop <= start:
+        return []
+    if unit is None:
+        return [(start, stop)]
+    shards = []
+    while start < stop:
+        boundary = min(_next_boundary(start, unit), stop)
+        shards.append((start, boundary))
+        start = boundary
+    return shards
+
+
+def date_window(start, stop, field='dateEntered'):
+    """Conditions on a date field (dateEntered by default) for [start, stop)."""
+    return f"{field} >= [{start.isoformat()}] AND {field} < [{stop.isoformat()}]"
+
+
+def search_shards(conditions, date_range, unit='month', today=None):
+    """
+    Split a search into per-shard conditions.
+    conditions: Conditions applied to every shard (e.g. the owner), or None.
+    date_range: (start_date, end_date), both inclusive; None searches conditions as is.
+    Returns [(shard_conditions, closed)].
+    """
+    if date_range is None:
+        return [(conditions, False)]
+    today = today or date.today()
+    shards = []
+    for start, stop in date_shards(date_range[0], date_range[1], unit):
+        window = date_window(start, stop)
+        # One day of slack for timezones between us and ConnectWise
+        closed = stop < today
+        shards.append((f"({conditions}) AND ({window})" if conditions else window, closed))
+    return shards
@@ -8,7 +8,7 @@ def debug_ticket_structure():
     cw = ConnectWiseClient()
     
     # Fetch just 1 ticket to inspect structure
-    tickets = cw.get_tickets(page_size=1)
+    tickets = cw.get_tickets(page=1, page_size=1)
     if tickets:
         print(json.dumps(tickets[0], indent=2))
     else:
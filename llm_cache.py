@@ -0,0 +1,104 @@
+"""
+Disk-backed cache of LLM responses.
+
+Entries are content-addressed: the key is a hash of (provider, model,
+normalized prompt), so any identical prompt - a whole report or one
+map-reduce batch - is answered from disk. Entries expire after a TTL and
+the least recently used ones are evicted once the store exceeds its size cap.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from sqlite_store import connect, path_from_env
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so indentation-only differences map to the same key."""
+    return " ".join(prompt.split())
+
+
+def cache_key(provider, model, prompt):
+    payload = json.dumps([provider, model, normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite store of LLM responses with TTL expiry and LRU size eviction."""
+
+    def __init__(self, path, ttl=None, max_bytes=None):
+        self.path = path
+        self.ttl = ttl if ttl is not None else int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("LLM_CACHE_MAX_MB", "100")) * 1024 * 1024
+        self._lock = threading.Lock()
+        self._conn = connect(path, SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """Build the cache from LLM_CACHE_PATH, or return None when it is "off"."""
+        path = path_from_env("LLM_CACHE_PATH", "llm_responses.sqlite3")
+        return cls(path) if path else None
+
+    def get(self, provider, model, prompt):
+        """Return the cached response for this prompt, or None."""
+        key = cache_key(provider, model, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return response
+
+    def put(self, provider, model, prompt, response):
+        if not response:
+            return
+        key = cache_key(provider, model, prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under the cap
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        doomed = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
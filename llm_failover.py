@@ -0,0 +1,77 @@
+"""
+Per-provider circuit breakers for LLM calls.
+
+Every provider call reports its outcome to the provider's CircuitBreaker,
+which keeps the recent latencies and a count of consecutive failures:
+- after LLM_BREAKER_FAILURES failures in a row the breaker opens and the
+  provider is skipped by failover chains,
+- after LLM_BREAKER_COOLDOWN seconds one trial call is let through
+  (half-open); success closes the breaker, failure opens it again.
+The recent latencies order fallback providers and size hedge delays.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Thread-safe breaker tracking one provider's recent latency and errors."""
+
+    def __init__(self, failure_threshold=None, cooldown=None, window=20):
+        self.failure_threshold = failure_threshold or int(os.getenv('LLM_BREAKER_FAILURES', '3'))
+        self.cooldown = cooldown if cooldown is not None else float(os.getenv('LLM_BREAKER_COOLDOWN', '60'))
+        self.state = CLOSED
+        self.failures = 0
+        self._latencies = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go to this provider now; a half-open breaker admits one trial at a time."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open trial admitted by allow() that made no provider call."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self.failures = 0
+            self.state = CLOSED
+            self._trial_running = False
+
+    def record_failure(self):
+        """Count a failed call; returns True when this failure opened the breaker."""
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def latency(self, quantile=0.5):
+        """A quantile of the recent successful call latencies, or None before any."""
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+            return ordered[min(int(len(ordered) * quantile), len(ordered) - 1)]
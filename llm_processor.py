@@ -1,4 +1,11 @@
+import io
 import os
+import time
+import threading
+import concurrent.futures
+import metrics
+from llm_cache import ResponseCache
+from llm_failover import CircuitBreaker
 
 class LLMProcessor:
     """Multi-provider LLM processor supporting Gemini, OpenAI, and Anthropic."""
@@ -7,21 +14,47 @@ class LLMProcessor:
         'gemini': {
             'name': 'Google Gemini',
             'env_key': 'GOOGLE_API_KEY',
-            'models': ['gemini-flash-latest', 'gemini-pro-latest', 'gemini-3-flash-preview', 'gemini-3-pro-preview']
+            'models': ['gemini-flash-latest', 'gemini-pro-latest', 'gemini-3-flash-preview', 'gemini-3-pro-preview'],
+            'context_tokens': 1000000
         },
         'openai': {
             'name': 'OpenAI',
             'env_key': 'OPENAI_API_KEY',
-            'models': ['gpt-5-mini', 'gpt-5-nano', 'gpt-5.2']
+            'models': ['gpt-5-mini', 'gpt-5-nano', 'gpt-5.2'],
+            'context_tokens': 400000
         },
         'anthropic': {
             'name': 'Anthropic',
             'env_key': 'ANTHROPIC_API_KEY',
-            'models': ['claude-sonnet-4-5', 'claude-haiku-4-5']
+            'models': ['claude-sonnet-4-5', 'claude-haiku-4-5'],
+            'context_tokens': 200000
         }
     }
     
-    def __init__(self, provider='gemini', model=None):
+    SYSTEM_PROMPT = "You are a strategic business analyst and career negotiation consultant."
+    
+    # Closes every prompt after its data section
+    PROMPT_END = "\n        "
+    
+    # Process-wide response cache, created on first use
+    _response_cache = None
+    _response_cache_loaded = False
+    _response_cache_lock = threading.Lock()
+    
+    # Process-wide cap on in-flight calls per provider (LLM_PROVIDER_CONCURRENCY)
+    _provider_slots = {}
+    _provider_slots_lock = threading.Lock()
+    
+    # Process-wide circuit breaker per provider
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+    
+    # Process-wide SDK clients keyed by (provider, api_key); they are thread-safe and
+    # keep their HTTP connections alive, so every processor reuses them
+    _clients = {}
+    _clients_lock = threading.Lock()
+    
+    def __init__(self, provider='gemini', model=None, use_cache=True, failover=None, hedge_after=None):
         self.provider = provider.lower()
         if self.provider not in self.PROVIDERS:
             raise ValueError(f"Unknown provider: {provider}. Supported: {list(self.PROVIDERS.keys())}")
@@ -31,25 +64,103 @@ class LLMProcessor:
         # Use provided model or default to the first one in the list
         self.model = model if model else config['models'][0]
         
+        # Prompts above this estimated size are summarized map-reduce style
+        # (LLM_BATCH_TOKENS); batches are mapped LLM_MAP_CONCURRENCY at a time
+        self.batch_tokens = int(os.getenv('LLM_BATCH_TOKENS', min(config['context_tokens'] // 2, 120000)))
+        self.map_concurrency = int(os.getenv('LLM_MAP_CONCURRENCY', '4'))
+        # At most LLM_PROVIDER_CONCURRENCY calls to this provider are in flight per process
+        self.provider_concurrency = int(os.getenv('LLM_PROVIDER_CONCURRENCY', '4'))
+        self.slots = self.provider_slots(self.provider, self.provider_concurrency)
+        self.breaker = self.provider_breaker(self.provider)
+        
+        # When this provider fails (or its breaker is open) the other available providers
+        # are tried in turn (LLM_FAILOVER=off disables; answered_by names who answered). With
+        # hedging, a second provider is also asked once a call has been running LLM_HEDGE_AFTER
+        # seconds; first answer wins.
+        self.failover = failover if failover is not None else os.getenv('LLM_FAILOVER', 'on').lower() != 'off'
+        self.hedge_after = hedge_after if hedge_after is not None else float(os.getenv('LLM_HEDGE_AFTER', '0'))
+        self._fallbacks = None
+        self._fallbacks_lock = threading.Lock()
+        # Which provider and model answered, per calling thread (see answered_by)
+        self._answered = threading.local()
+        
+        # With use_cache=False cached responses are ignored, but fresh ones are still stored
+        self.use_cache = use_cache
+        self.cache = self.get_response_cache()
+        
         if model and model not in config['models']:
             # Optional: Allow custom models or warn, but for now we'll allow it passed through
             pass
 
+        self.client = self._create_client(config)
+    
+    def _create_client(self, config):
+        """Return the shared SDK client for the configured provider."""
         api_key = os.getenv(config['env_key'])
         
         if not api_key:
             raise ValueError(f"Missing {config['env_key']} in environment variables.")
         
-        # Initialize the appropriate client
-        if self.provider == 'gemini':
+        return self.provider_client(self.provider, api_key)
+    
+    @staticmethod
+    def _new_client(provider, api_key):
+        """Initialize the SDK client for a provider."""
+        if provider == 'gemini':
             from google import genai
-            self.client = genai.Client(api_key=api_key)
-        elif self.provider == 'openai':
+            return genai.Client(api_key=api_key)
+        elif provider == 'openai':
             from openai import OpenAI
-            self.client = OpenAI(api_key=api_key)
-        elif self.provider == 'anthropic':
+            return OpenAI(api_key=api_key)
+        elif provider == 'anthropic':
             import anthropic
-            self.client = anthropic.Anthropic(api_key=api_key)
+            return anthropic.Anthropic(api_key=api_key)
+    
+    @classmethod
+    def provider_client(cls, provider, api_key):
+        """The SDK client for a provider and API key, created once per process."""
+        key = (provider, api_key)
+        with cls._clients_lock:
+            if key not in cls._clients:
+                cls._clients[key] = cls._new_client(provider, api_key)
+            return cls._clients[key]
+    
+    @classmethod
+    def preload_clients(cls):
+        """Create the clients of every configured provider (e.g. at worker startup); returns their names."""
+        loaded = []
+        for provider in dict.fromkeys(p['provider'] for p in cls.get_available_providers()):
+            try:
+                cls.provider_client(provider, os.getenv(cls.PROVIDERS[provider]['env_key']))
+                loaded.append(provider)
+            except Exception as e:
+                print(f"Error preloading {provider} client: {e}")
+        return loaded
+    
+    @classmethod
+    def get_response_cache(cls):
+        """Return the shared ResponseCache (LLM_CACHE_PATH), or None when disabled."""
+        with cls._response_cache_lock:
+            if not cls._response_cache_loaded:
+                cls._response_cache = ResponseCache.from_env()
+                cls._response_cache_loaded = True
+            return cls._response_cache
+    
+    @classmethod
+    def provider_slots(cls, provider, size):
+        """Semaphore bounding concurrent calls to one provider across every processor."""
+        with cls._provider_slots_lock:
+            if provider not in cls._provider_slots:
+                cls._provider_slots[provider] = threading.BoundedSemaphore(size)
+            return cls._provider_slots[provider]
+    
+    @classmethod
+    def provider_breaker(cls, provider):
+        """CircuitBreaker shared by every processor calling one provider."""
+        with cls._breakers_lock:
+            if provider not in cls._breakers:
+                cls._breakers[provider] = CircuitBreaker()
+            return cls._breakers[provider]
     
     @classmethod
     def get_available_providers(cls):
@@ -69,20 +180,56 @@ class LLMProcessor:
                     })
         return available
     
-    def _build_prompt(self, ticket_data, technician_name="the employee"):
-        """Build the prompt from ticket data."""
-        prompt_data = []
-        for t in ticket_data:
-            prompt_data.append(f"""
+    @staticmethod
+    def estimate_tokens(text):
+        """Rough token estimate (~4 characters per token) used for batch packing."""
+        return len(text) // 4 + 1
+    
+    @staticmethod
+    def _write_ticket(write, t):
+        """Write one ticket's data for a prompt; TicketRecord notes are streamed, not joined."""
+        write(f"""
             Ticket: {t['summary']} (ID: {t['id']})
             Date: {t['date']}
             Total Hours: {t['total_hours']}
-            Notes: {t['notes']}
+            Notes: """)
+        if hasattr(t, 'write_notes'):
+            t.write_notes(write)
+        else:
+            write(str(t['notes']))
+        write("""
             --------------------------------------------------
             """)
-        
-        full_text = "\n".join(prompt_data)
-        
+    
+    @classmethod
+    def _format_ticket(cls, t):
+        """Format one ticket's data for a prompt."""
+        out = io.StringIO()
+        cls._write_ticket(out.write, t)
+        return out.getvalue()
+    
+    def _tickets_prompt(self, instructions, ticket_data):
+        """Instructions followed by every ticket, written in one pass into a single buffer."""
+        out = io.StringIO()
+        out.write(instructions)
+        for i, t in enumerate(ticket_data):
+            if i:
+                out.write("\n")
+            self._write_ticket(out.write, t)
+        out.write(self.PROMPT_END)
+        return out.getvalue()
+    
+    def _build_prompt(self, ticket_data, technician_name="the employee"):
+        """Build the prompt from ticket data."""
+        data_description = f"Ticket summaries, notes, and time logs for {technician_name}."
+        return self._tickets_prompt(self._report_instructions(technician_name, data_description), ticket_data)
+    
+    def _report_prompt(self, technician_name, data_description, full_text):
+        """The Strategic Value Report instructions followed by the data to analyze."""
+        return self._report_instructions(technician_name, data_description) + full_text + self.PROMPT_END
+    
+    def _report_instructions(self, technician_name, data_description):
+        """The Strategic Value Report instructions, up to where the data goes."""
         return f"""
         You are a Strategic Business Analyst specializing in translating technical work into business value for performance reviews.
         
@@ -91,7 +238,7 @@ class LLMProcessor:
         Your objective is to transform the provided ConnectWise ticket data into a compelling business case that demonstrates Return on Investment (ROI) and value to the organization.
         
         **Data Provided:**
-        Ticket summaries, notes, and time logs for {technician_name}.
+        {data_description}
         
         **Instructions:**
         Generate a **Strategic Value Report** that highlights achievements and contributions. Do not just list tasks. Translate technical work into **business value** and **organizational impact**.
@@ -124,32 +271,423 @@ class LLMProcessor:
         **Focus:** Demonstrate the tangible value {technician_name} brings to the organization.
         
         Data:
+        """
+    
+    def _build_map_prompt(self, ticket_data, technician_name, batch_number, batch_count):
+        """Prompt that condenses one batch of tickets into notes for the final report."""
+        return self._tickets_prompt(self._map_instructions(technician_name, batch_number, batch_count), ticket_data)
+    
+    def _map_instructions(self, technician_name, batch_number, batch_count):
+        return f"""
+        You are a Strategic Business Analyst preparing material for a Strategic Value Report about **{technician_name}**.
+        
+        This is batch {batch_number} of {batch_count} of their ConnectWise tickets. Another step will merge the notes from every batch into the final report, so do not write the report itself.
+        
+        Extract the evidence from this batch as concise bullet points, grouped under these headings:
+        1. Direct Financial Impact & ROI
+        2. Strategic Contributions & Team Enablement
+        3. Critical Infrastructure & Reliability
+        4. Innovation & Growth Initiatives
+        5. Professional Excellence
+        
+        For every point keep the ticket ID, the date, the hours spent and any quantifiable facts (time or money saved, users affected, downtime prevented). Merge repetitive routine work into one point with a count and total hours. Omit headings with no evidence.
+        
+        Data:
+        """
+    
+    def _build_condense_prompt(self, partials, technician_name):
+        """Prompt that merges several batch notes into one shorter set of notes."""
+        full_text = "\n\n".join(partials)
+        return f"""
+        You are a Strategic Business Analyst preparing material for a Strategic Value Report about **{technician_name}**.
+        
+        Merge the following evidence notes into one set of concise bullet points under the same five headings. Keep ticket IDs, dates, hours and quantifiable facts; combine duplicates and routine work.
+        
+        Notes:
         {full_text}
         """
     
-    def summarize_quarterly_work(self, ticket_data, technician_name="the employee"):
+    def _pack_batches(self, ticket_data, budget):
+        """
+        Greedily pack tickets into batches whose estimated prompt size stays within budget.
+        A single ticket larger than the budget gets its notes truncated to fit.
+        """
+        overhead = self.estimate_tokens(self._build_map_prompt([], "the employee", 1, 1))
+        available = max(budget - overhead, 1)
+        
+        batches = []
+        current = []
+        current_tokens = 0
+        for t in ticket_data:
+            tokens = self.estimate_tokens(self._format_ticket(t))
+            if tokens > available:
+                keep_chars = max(len(t['notes']) - (tokens - available) * 4, 0)
+                t = dict(t, notes=t['notes'][:keep_chars] + "\n[notes truncated]")
+                tokens = self.estimate_tokens(self._format_ticket(t))
+            if current and current_tokens + tokens > available:
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(t)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _map_batches(self, prompts):
+        """Run the map prompts concurrently and return their responses in order."""
+        if len(prompts) == 1:
+            return [self._generate(prompts[0])]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.map_concurrency, len(prompts))) as executor:
+            return list(executor.map(metrics.bind(self._generate), prompts))
+    
+    def _build_reduce_prompt(self, ticket_data, technician_name):
+        """
+        Map step: summarize context-sized ticket batches in parallel, condensing the
+        partial summaries until they fit. Returns the final report prompt.
+        """
+        partials, batch_count = self._condense(ticket_data, technician_name)
+        data_description = (
+            f"Evidence notes extracted from {len(ticket_data)} ConnectWise tickets (summaries, notes, and time logs) "
+            f"for {technician_name}, prepared in {batch_count} batches."
+        )
+        return self._report_prompt(technician_name, data_description, "\n\n".join(partials))
+    
+    def _condense(self, ticket_data, technician_name):
+        """Summarize tickets into evidence notes that fit one prompt; returns (partials, batch_count)."""
+        batches = self._pack_batches(ticket_data, self.batch_tokens)
+        partials = self._map_batches([
+            self._build_map_prompt(batch, technician_name, i + 1, len(batches))
+            for i, batch in enumerate(batches)
+        ])
+        
+        # Condense until every partial fits in one reduce prompt
+        while len(partials) > 1 and self.estimate_tokens("\n\n".join(partials)) > self.batch_tokens:
+            groups = []
+            for partial in partials:
+                if groups and self.estimate_tokens("\n\n".join(groups[-1] + [partial])) <= self.batch_tokens:
+                    groups[-1].append(partial)
+                else:
+                    groups.append([partial])
+            if len(groups) == len(partials):
+                # No two partials fit together; condense pairs so the loop always shrinks
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            partials = self._map_batches([self._build_condense_prompt(group, technician_name) for group in groups])
+        return partials, len(batches)
+    
+    def _merge_instructions(self, existing_report, technician_name, data_description, updated_ids=()):
+        """Instructions for folding new evidence into an existing report, up to where the data goes."""
+        if updated_ids:
+            coverage = (f"Tickets {', '.join(f'#{ticket_id}' for ticket_id in updated_ids)} are already covered by "
+                        f"the report and have since been updated: revise their entries instead of repeating them. "
+                        f"All other tickets are new.")
+        else:
+            coverage = "All of these tickets are new to the report."
+        return f"""
+        You are a Strategic Business Analyst updating an existing Strategic Value Report for **{technician_name}**.
+        
+        The current report is below, followed by {data_description}
+        
+        **Instructions:**
+        Integrate the new evidence into the report. Keep its structure, headings, tone and existing content; add new achievements under the matching sections and update figures (hours, counts, savings) that the new work changes. {coverage} Return the complete updated report only.
+        
+        **Current Report:**
+        {existing_report}
+        
+        New Data:
+        """
+    
+    def _merge_prompt_for(self, existing_report, ticket_data, technician_name, mode, covered_ids=None):
+        """The prompt merging new tickets into a report; large ticket sets are condensed map-reduce style first."""
+        if mode not in ('auto', 'single', 'map_reduce'):
+            raise ValueError(f"Unknown summarization mode: {mode}. Supported: auto, single, map_reduce")
+        covered = set(covered_ids or ())
+        updated_ids = sorted(t.id for t in ticket_data if t.id in covered)
+        if mode != 'map_reduce':
+            data_description = (f"ticket summaries, notes, and time logs for {len(ticket_data)} tickets entered "
+                                f"or updated since it was written.")
+            prompt = self._tickets_prompt(
+                self._merge_instructions(existing_report, technician_name, data_description, updated_ids), ticket_data
+            )
+            if mode == 'single' or self.estimate_tokens(prompt) <= self.batch_tokens:
+                return prompt
+        partials, batch_count = self._condense(ticket_data, technician_name)
+        data_description = (f"evidence notes extracted from {len(ticket_data)} tickets entered or updated since it "
+                            f"was written, prepared in {batch_count} batches.")
+        return (self._merge_instructions(existing_report, technician_name, data_description, updated_ids)
+                + "\n\n".join(partials) + self.PROMPT_END)
+    
+    def _prompt_for(self, ticket_data, technician_name, mode):
+        """Pick single-shot or map-reduce for this data and return the final prompt."""
+        if mode not in ('auto', 'single', 'map_reduce'):
+            raise ValueError(f"Unknown summarization mode: {mode}. Supported: auto, single, map_reduce")
+        if mode == 'single':
+            return self._build_prompt(ticket_data, technician_name)
+        if mode == 'auto':
+            prompt = self._build_prompt(ticket_data, technician_name)
+            if self.estimate_tokens(prompt) <= self.batch_tokens:
+                return prompt
+        return self._build_reduce_prompt(ticket_data, technician_name)
+    
+    def summarize_quarterly_work(self, ticket_data, technician_name="the employee", mode='auto'):
         """
         Generate a strategic value report from ticket data.
         ticket_data: List of dicts containing ticket info, notes, and time.
         technician_name: Name of the technician for the report.
+        mode: 'single' sends one prompt, 'map_reduce' summarizes token-budgeted batches
+              in parallel and merges them, 'auto' switches to map-reduce when the single
+              prompt would exceed the batch budget.
+        """
+        prompt = self._prompt_for(ticket_data, technician_name, mode)
+        return self._generate(prompt)
+    
+    def stream_quarterly_work(self, ticket_data, technician_name="the employee", mode='auto'):
+        """Like summarize_quarterly_work, but yields the report text as the provider streams it."""
+        prompt = self._prompt_for(ticket_data, technician_name, mode)
+        return self._stream(prompt)
+    
+    def merge_report(self, existing_report, ticket_data, technician_name="the employee", mode='auto',
+                     covered_ids=None):
+        """
+        Update an existing report with tickets entered or updated since it was written.
+        Only the new tickets are sent (condensed map-reduce style when they exceed the
+        batch budget), so the cost follows the new work rather than the whole period.
+        covered_ids: Ids of the tickets the existing report covers; those are marked as
+        updates to revise rather than new work to add.
+        """
+        prompt = self._merge_prompt_for(existing_report, ticket_data, technician_name, mode, covered_ids)
+        return self._generate(prompt)
+    
+    def stream_merged_report(self, existing_report, ticket_data, technician_name="the employee", mode='auto',
+                             covered_ids=None):
+        """Like merge_report, but yields the updated report text as the provider streams it."""
+        prompt = self._merge_prompt_for(existing_report, ticket_data, technician_name, mode, covered_ids)
+        return self._stream(prompt)
+    
+    def _cached(self, prompt):
+        """The cached response to a prompt, or None."""
+        if self.cache is None or not self.use_cache:
+            return None
+        cached = self.cache.get(self.provider, self.model, prompt)
+        if cached is not None:
+            metrics.count('llm_cache_hits_total', provider=self.provider, model=self.model)
+        return cached
+    
+    def _fallback_processors(self):
+        """Processors for the other available providers (their default model), created on first use."""
+        with self._fallbacks_lock:
+            if self._fallbacks is None:
+                self._fallbacks = []
+                providers = {p['provider'] for p in self.get_available_providers()} - {self.provider}
+                for provider in self.PROVIDERS:
+                    if provider not in providers:
+                        continue
+                    try:
+                        self._fallbacks.append(type(self)(provider=provider, use_cache=self.use_cache,
+                                                          failover=False, hedge_after=0))
+                    except Exception as e:
+                        print(f"Skipping fallback provider {provider}: {e}")
+            return self._fallbacks
+    
+    @property
+    def answered_by(self):
+        """
+        (provider, model) that produced the latest response generated or streamed on this thread,
+        or None before any. It differs from this processor's own after a failover or hedge.
+        """
+        return getattr(self._answered, 'by', None)
+    
+    def _answer(self, processor, text):
+        """Record processor as the one that answered on this thread and return its text."""
+        self._answered.by = (processor.provider, processor.model)
+        return text
+    
+    def _candidates(self):
+        """
+        Yield the processors to try, in order, each admitted by its circuit breaker:
+        this one, then the fallbacks fastest first (by recent median latency).
+        When every breaker is open this processor is still tried, so a call never fails unattempted.
+        """
+        attempted = False
+        if self.breaker.allow():
+            attempted = True
+            yield self
+        if self.failover:
+            fallbacks = self._fallback_processors()
+            unknown = float('inf')
+            for fallback in sorted(fallbacks, key=lambda p: p.breaker.latency() or unknown):
+                if fallback.breaker.allow():
+                    attempted = True
+                    yield fallback
+        if not attempted:
+            yield self
+    
+    def _attempt(self, prompt):
+        """One call to this processor's provider, recorded in its breaker and the response cache."""
+        started = time.perf_counter()
+        try:
+            with self.slots, metrics.span('llm_call_seconds', provider=self.provider, model=self.model,
+                                          mode='generate'):
+                text = self._call_provider(prompt)
+        except Exception:
+            self._record_failure()
+            raise
+        self.breaker.record_success(time.perf_counter() - started)
+        if self.cache is not None:
+            self.cache.put(self.provider, self.model, prompt, text)
+        return text
+    
+    def _record_failure(self):
+        metrics.count('llm_call_errors_total', provider=self.provider, model=self.model)
+        if self.breaker.record_failure():
+            metrics.count('llm_circuit_opened_total', provider=self.provider)
+    
+    def _generate(self, prompt):
+        """Return the response to a prompt, from the cache when possible, failing over between providers."""
+        cached = self._cached(prompt)
+        if cached is not None:
+            return self._answer(self, cached)
+        if self.hedge_after > 0:
+            return self._generate_hedged(prompt)
+        
+        error = None
+        for processor in self._candidates():
+            if processor is not self:
+                metrics.count('llm_failovers_total', provider=processor.provider)
+                # A fallback may already have answered this prompt; no call means no trial outcome
+                cached = processor._cached(prompt)
+                if cached is not None:
+                    processor.breaker.release()
+                    return self._answer(processor, cached)
+            try:
+                return self._answer(processor, processor._attempt(prompt))
+            except Exception as e:
+                error = error or e
+        raise error
+    
+    def _generate_hedged(self, prompt):
         """
-        prompt = self._build_prompt(ticket_data, technician_name)
+        Call the first candidate; every hedge_after seconds without an answer (or on an error)
+        call the next one as well. The first response wins; the others are left to finish
+        in the background (SDK calls cannot be cancelled) and only fill the cache.
+        """
+        candidates = self._candidates()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.PROVIDERS) + 1,
+                                                         thread_name_prefix="llm-hedge")
+        pending = {}
+        error = None
+        
+        def launch():
+            processor = next(candidates, None)
+            if processor is None:
+                return False
+            if processor is not self:
+                metrics.count('llm_failovers_total', provider=processor.provider)
+            pending[executor.submit(metrics.bind(processor._attempt), prompt)] = processor
+            return True
         
+        try:
+            launch()
+            can_hedge = True
+            while pending:
+                done, _ = concurrent.futures.wait(pending, timeout=self.hedge_after if can_hedge else None,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    metrics.count('llm_hedged_requests_total', provider=self.provider)
+                    can_hedge = launch()
+                    continue
+                for future in done:
+                    processor = pending.pop(future)
+                    try:
+                        return self._answer(processor, future.result())
+                    except Exception as e:
+                        error = error or e
+                if not pending:
+                    can_hedge = launch()
+            raise error
+        finally:
+            executor.shutdown(wait=False)
+    
+    def _stream(self, prompt):
+        """
+        Yield the response to a prompt in chunks; a cached response is yielded whole.
+        A provider that fails before its first chunk is failed over; later errors are raised.
+        """
+        cached = self._cached(prompt)
+        if cached is not None:
+            yield self._answer(self, cached)
+            return
+        
+        error = None
+        for processor in self._candidates():
+            if processor is not self:
+                metrics.count('llm_failovers_total', provider=processor.provider)
+            chunks = []
+            try:
+                for text in processor._attempt_stream(prompt, chunks):
+                    yield self._answer(processor, text)
+                return
+            except Exception as e:
+                if chunks:
+                    raise
+                error = error or e
+        raise error
+    
+    def _attempt_stream(self, prompt, chunks):
+        """One streaming call to this processor's provider; chunks collects what was yielded."""
+        started = time.perf_counter()
+        try:
+            with self.slots, metrics.span('llm_call_seconds', provider=self.provider, model=self.model,
+                                          mode='stream'):
+                for text in self._call_provider_stream(prompt):
+                    if not chunks:
+                        metrics.observe('llm_first_token_seconds', time.perf_counter() - started,
+                                        provider=self.provider, model=self.model)
+                    chunks.append(text)
+                    yield text
+        except GeneratorExit:
+            # The caller stopped reading; the provider did respond
+            self.breaker.record_success(time.perf_counter() - started)
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+        self.breaker.record_success(time.perf_counter() - started)
+        # Streaming APIs don't report usage uniformly; estimate instead
+        self._count_tokens(prompt, "".join(chunks))
+        if self.cache is not None:
+            self.cache.put(self.provider, self.model, prompt, "".join(chunks))
+    
+    def _count_tokens(self, prompt, text, usage=None):
+        """Record token counts; usage is the provider's (prompt, completion) counts, else they are estimated."""
+        if not usage or None in usage:
+            usage = (self.estimate_tokens(prompt), self.estimate_tokens(text or ""))
+        metrics.count('llm_tokens_total', usage[0], provider=self.provider, model=self.model, direction='prompt')
+        metrics.count('llm_tokens_total', usage[1], provider=self.provider, model=self.model, direction='completion')
+    
+    def _call_provider(self, prompt):
+        """Send a prompt to the configured provider and return the full response text."""
         if self.provider == 'gemini':
             response = self.client.models.generate_content(
                 model=self.model,
                 contents=prompt
             )
+            usage = getattr(response, 'usage_metadata', None)
+            self._count_tokens(prompt, response.text,
+                               usage and (usage.prompt_token_count, usage.candidates_token_count))
             return response.text
         
         elif self.provider == 'openai':
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": "You are a strategic business analyst and career negotiation consultant."},
+                    {"role": "system", "content": self.SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ]
             )
+            usage = getattr(response, 'usage', None)
+            self._count_tokens(prompt, response.choices[0].message.content,
+                               usage and (usage.prompt_tokens, usage.completion_tokens))
             return response.choices[0].message.content
         
         elif self.provider == 'anthropic':
@@ -160,4 +698,40 @@ class LLMProcessor:
                     {"role": "user", "content": prompt}
                 ]
             )
+            usage = getattr(response, 'usage', None)
+            self._count_tokens(prompt, response.content[0].text, usage and (usage.input_tokens, usage.output_tokens))
             return response.content[0].text
+    
+    def _call_provider_stream(self, prompt):
+        """Send a prompt using the provider's streaming API and yield text chunks."""
+        if self.provider == 'gemini':
+            for chunk in self.client.models.generate_content_stream(
+                model=self.model,
+                contents=prompt
+            ):
+                if chunk.text:
+                    yield chunk.text
+        
+        elif self.provider == 'openai':
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self.SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        
+        elif self.provider == 'anthropic':
+            with self.client.messages.stream(
+                model=self.model,
+                max_tokens=8192,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            ) as stream:
+                for text in stream.text_stream:
+                    yield text
@@ -1,11 +1,88 @@
 import os
-import time
+import argparse
+from datetime import date
 from dotenv import load_dotenv
-from connectwise_client import ConnectWiseClient
+from connectwise_client import MEMBER_FIELDS, ConnectWiseClient
+from ticket_pipeline import TicketPipeline
 from llm_processor import LLMProcessor
+from note_preprocessing import NotePreprocessor
+from member_directory import MemberDirectory
+from report_batch import run_batch_reports
+from date_shards import parse_date
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate strategic value reports from ConnectWise tickets.")
+    parser.add_argument("--members", help="Comma-separated member identifiers; writes one report per member")
+    parser.add_argument("--start-date", type=parse_date,
+                        help="First dateEntered to include (YYYY-MM-DD), required with --members")
+    parser.add_argument("--end-date", type=parse_date,
+                        help="Last dateEntered to include (YYYY-MM-DD), defaults to today")
+    parser.add_argument("--provider", default="gemini", help="LLM provider, optionally as provider:model")
+    parser.add_argument("--output-dir", default="reports", help="Where --members reports are written")
+    args = parser.parse_args()
+    if args.members and not args.start_date:
+        parser.error("--start-date is required with --members")
+    return args
+
+def run_batch(args):
+    """One report per member, sharing the ticket searches, detail fetches and LLM client."""
+    member_ids = list(dict.fromkeys(m.strip() for m in args.members.split(",") if m.strip()))
+    end_date = args.end_date or date.today().isoformat()
+    provider, _, model = args.provider.partition(":")
+
+    print("Initializing clients...")
+    try:
+        cw = ConnectWiseClient()
+        llm = LLMProcessor(provider=provider, model=model or None)
+    except Exception as e:
+        print(f"Initialization Failed: {e}")
+        return
+
+    directory = MemberDirectory(lambda: cw.get_members(fields=MEMBER_FIELDS))
+    members = {}
+    for member_id in member_ids:
+        try:
+            member = directory.get(member_id)
+        except Exception as e:
+            print(f"Could not load member names, using identifiers: {e}")
+            member = None
+        members[member_id] = member['name'] if member and member['name'] else member_id
+
+    async_cw = None
+    if os.getenv("CW_ASYNC_CLIENT"):
+        from async_connectwise_client import AsyncClientAdapter
+        async_cw = AsyncClientAdapter(scheduler=cw.scheduler, cache=cw.cache, single_flight=cw.single_flight)
+
+    def on_progress(stage, done, total):
+        if stage == 'llm':
+            print(f"[{done}/{total}] Reports written")
+
+    print(f"Fetching tickets for {len(member_ids)} members from {args.start_date} to {end_date}...")
+    preprocessor = NotePreprocessor()
+    try:
+        result = run_batch_reports(cw, llm, members, args.start_date, end_date, preprocessor=preprocessor,
+                                   async_client=async_cw, on_progress=on_progress)
+    finally:
+        if async_cw is not None:
+            async_cw.close()
+    print(f"Processed {result['ticket_count']} tickets ({result['failed_count']} failed).")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for member_id, report in result['reports'].items():
+        if 'error' in report:
+            print(f"{member_id}: report failed: {report['error']}")
+            continue
+        path = os.path.join(args.output_dir, f"{member_id}_summary.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report['report'])
+        print(f"{member_id}: {report['ticket_count']} tickets -> {path}")
 
 def main():
     load_dotenv()
+    args = parse_args()
+    if args.members:
+        run_batch(args)
+        return
     
     # Check for member ID to filter "my" tickets
     member_id = os.getenv("CW_MEMBER_ID")
@@ -16,7 +93,8 @@ def main():
     print("Initializing clients...")
     try:
         cw = ConnectWiseClient()
-        llm = LLMProcessor()
+        provider, _, model = args.provider.partition(":")
+        llm = LLMProcessor(provider=provider, model=model or None)
     except Exception as e:
         print(f"Initialization Failed: {e}")
         return
@@ -29,75 +107,49 @@ def main():
     # Let's filter by date to keep it sane for a first run, e.g., > 2024-01-01
     
     conditions = 'dateEntered > [2025-02-01]'
+    date_range = None
+    if args.start_date:
+        # Searched in date shards rather than as one dateEntered window
+        conditions = None
+        date_range = (args.start_date, args.end_date or date.today().isoformat())
     if member_id:
-        conditions = f'(owner/identifier="{member_id}") AND ({conditions})'
+        owner = f'owner/identifier="{member_id}"'
+        conditions = f'({owner}) AND ({conditions})' if conditions else owner
 
     print(f"Querying with conditions: {conditions}")
+    if date_range:
+        print(f"Date range: {date_range[0]} to {date_range[1]}")
     
-    # limits
-    MAX_TICKETS = 1000 # Increased for production run
-    
-    print("Fetching Service Tickets...")
-    service_tickets = cw.get_tickets(conditions=conditions, page_size=MAX_TICKETS) or []
-    print(f"Found {len(service_tickets)} service tickets.")
+    # Strips quoted replies, signatures and duplicate notes before they reach the prompt
+    preprocessor = NotePreprocessor()
 
-    print("Fetching Project Tickets...")
-    project_tickets = cw.get_project_tickets(conditions=conditions, page_size=MAX_TICKETS) or []
-    print(f"Found {len(project_tickets)} project tickets.")
-    
-    # Merge
-    tickets = service_tickets + project_tickets
-    
-    if not tickets:
+    async_cw = None
+    if os.getenv("CW_ASYNC_CLIENT"):
+        # asyncio fan-out over one pooled connection set instead of a thread per request
+        from async_connectwise_client import AsyncClientAdapter
+        async_cw = AsyncClientAdapter(scheduler=cw.scheduler, cache=cw.cache, single_flight=cw.single_flight)
+
+    def on_progress(stage, done, total):
+        if stage == 'details':
+            print(f"[{done}/{total or '?'}] Processed ticket details")
+
+    # specific notes: user wants "ticket title and all associated notes", so notes are not filtered by member
+    pipeline = TicketPipeline(cw, preprocessor=preprocessor, async_client=async_cw)
+    try:
+        processed_data = pipeline.collect(conditions, on_progress=on_progress, date_range=date_range)
+    finally:
+        if async_cw is not None:
+            async_cw.close()
+
+    if not pipeline.ticket_count:
         print("No tickets found.")
         return
+    print(f"Processed details for {len(processed_data)}/{pipeline.ticket_count} tickets.")
+    print("Stage timings (s): " + ", ".join(f"{stage} {seconds}" for stage, seconds in pipeline.stats()['stage_seconds'].items()))
 
-    print(f"Total {len(tickets)} tickets to process. Fetching details concurrently...")
-    
-    processed_data = []
-    
-    import concurrent.futures
-
-    def process_ticket(t):
-        t_id = t['id']
-        t_summary = t['summary']
-        # Fix KeyError: 'dateEntered' - Use .get() safely
-        t_date = t.get('dateClosed') or t.get('dateEntered') or "Unknown Date"
-        
-        # print(f"Processing Ticket #{t_id}: {t_summary}") # Too noisy for threads
-        
-        # specific notes: user wants "ticket title and all associated notes"
-        notes = cw.get_ticket_notes(t_id)
-        notes_text = ""
-        if notes:
-            notes_text = "\n".join([f"- [{n.get('dateCreated')}] {n.get('text')}" for n in notes])
-            
-        # Time
-        total_time = cw.get_total_time_for_ticket(t_id)
-        
-        return {
-            'id': t_id,
-            'summary': t_summary,
-            'date': t_date,
-            'notes': notes_text,
-            'total_hours': total_time
-        }
-
-    # Use ThreadPoolExecutor for I/O bound parallelism
-    # Be mindful of API rate limits. 10 workers is usually safe for occasional use.
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_ticket = {executor.submit(process_ticket, t): t for t in tickets}
-        
-        for i, future in enumerate(concurrent.futures.as_completed(future_to_ticket)):
-            t = future_to_ticket[future]
-            try:
-                data = future.result()
-                processed_data.append(data)
-                if (i + 1) % 1 == 0:
-                    print(f"[{i+1}/{len(tickets)}] Processed details for {data['summary']}")
-            except Exception as exc:
-                print(f"Ticket {t['id']} generated an exception: {exc}")
-
+    stats = preprocessor.stats()
+    print(f"Note text reduced to {stats['compression_ratio']:.0%} of raw size "
+          f"({stats['kept_chars']}/{stats['raw_chars']} chars, {stats['notes_kept']}/{stats['notes_in']} notes).")
     print("Data collection complete. Generating Quarterly Summary...")
     
     summary = llm.summarize_quarterly_work(processed_data)
@@ -0,0 +1,133 @@
+"""
+In-memory ConnectWise member directory.
+
+The member roster rarely changes, so it is loaded once and served from
+memory. After MEMBER_CACHE_TTL seconds the cached roster is still served
+while a background thread refreshes it (stale-while-revalidate), so no
+page load waits on ConnectWise once the directory is warm.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def simplify_member(m):
+    """The member fields the web form needs."""
+    return {
+        'id': m.get('identifier'),
+        'name': f"{m.get('firstName', '')} {m.get('lastName', '')}".strip(),
+        'identifier': m.get('identifier')
+    }
+
+
+class MemberDirectory:
+    """Cached member list with identifier and name-prefix indexes."""
+
+    def __init__(self, fetch_members, ttl=None):
+        # fetch_members: callable returning raw ConnectWise member dicts
+        self.fetch_members = fetch_members
+        self.ttl = ttl if ttl is not None else int(os.getenv("MEMBER_CACHE_TTL", "3600"))
+        self.members = None
+        self.etag = None
+        self.loaded_at = None
+        self._by_identifier = {}
+        self._prefixes = []
+        self._lock = threading.Lock()
+        # Held while loading, so concurrent first requests share one ConnectWise call
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+
+    def get_members(self):
+        """
+        Return (members, etag). Only the very first call waits for ConnectWise;
+        a stale roster is returned immediately and refreshed in the background.
+        """
+        if self.members is None:
+            with self._load_lock:
+                if self.members is None:
+                    self.refresh()
+        elif time.monotonic() - self.loaded_at > self.ttl:
+            self.refresh_async()
+        with self._lock:
+            return self.members, self.etag
+
+    def get(self, identifier):
+        self.get_members()
+        with self._lock:
+            return self._by_identifier.get((identifier or "").lower())
+
+    def search(self, query, limit=20):
+        """Members whose identifier, first name, last name or full name starts with query."""
+        self.get_members()
+        with self._lock:
+            members, prefixes = self.members, self._prefixes
+        query = " ".join((query or "").lower().split())
+        if not query:
+            return members[:limit]
+
+        start = bisect.bisect_left(prefixes, (query,))
+        matches = []
+        seen = set()
+        for key, position in prefixes[start:]:
+            if not key.startswith(query) or len(matches) >= limit:
+                break
+            if position not in seen:
+                seen.add(position)
+                matches.append(position)
+        return [members[position] for position in sorted(matches)]
+
+    def refresh(self):
+        """
+        Reload the roster from ConnectWise and rebuild the indexes.
+        A failed first load raises; a failed refresh keeps serving the old roster.
+        """
+        try:
+            raw = self.fetch_members()
+        except Exception as e:
+            if self.members is None:
+                raise RuntimeError(f"Could not load members from ConnectWise: {e}") from e
+            print(f"Error refreshing member directory, keeping the old roster: {e}")
+            # Try again after another TTL
+            with self._lock:
+                self.loaded_at = time.monotonic()
+            return
+
+        members = sorted((simplify_member(m) for m in raw if m.get('identifier')),
+                         key=lambda m: m['name'].lower())
+        by_identifier = {m['identifier'].lower(): m for m in members}
+        prefixes = []
+        for position, m in enumerate(members):
+            keys = {m['identifier'].lower(), m['name'].lower()}
+            keys.update(m['name'].lower().split())
+            prefixes.extend((key, position) for key in keys if key)
+        prefixes.sort()
+        etag = hashlib.sha256(json.dumps(members, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+        with self._lock:
+            self.members = members
+            self._by_identifier = by_identifier
+            self._prefixes = prefixes
+            self.etag = etag
+            self.loaded_at = time.monotonic()
+
+    def refresh_async(self):
+        """Start a background refresh unless one is already running."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="member-refresh", daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            with self._load_lock:
+                self.refresh()
+        except Exception as e:
+            print(f"Error refreshing member directory: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
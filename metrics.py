@@ -0,0 +1,215 @@
+"""
+Lightweight timing and counter instrumentation.
+
+Every span is recorded twice: in the process-wide registry rendered at
+/metrics in the Prometheus text format, and in the active report's Timings
+breakdown when there is one. The active Timings lives in a contextvar;
+work handed to other threads is wrapped with bind() so it is still
+attributed to the report that started it.
+"""
+
+import contextlib
+import contextvars
+import re
+import threading
+import time
+
+# Histogram buckets in seconds, from a fast API call up to a long LLM generation
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+HELP = {
+    'connectwise_request_seconds': 'ConnectWise API request latency, including retries',
+    'connectwise_request_errors_total': 'ConnectWise requests that failed after retries',
+    'connectwise_coalesced_total': 'ConnectWise GETs answered by an identical in-flight or recent request',
+    'pipeline_stage_seconds': 'Ticket pipeline stage work (per item; one observation per search)',
+    'report_phase_seconds': 'Report generation phases',
+    'llm_call_seconds': 'LLM provider call latency',
+    'llm_first_token_seconds': 'Time until a streamed LLM response produced its first text',
+    'llm_tokens_total': 'LLM tokens sent and received',
+    'llm_cache_hits_total': 'LLM responses served from the response cache',
+    'llm_call_errors_total': 'LLM provider calls that raised an error',
+    'llm_failovers_total': 'LLM calls sent to a fallback provider',
+    'llm_hedged_requests_total': 'LLM calls that were slow enough to be hedged with another provider',
+    'llm_circuit_opened_total': 'Times a provider circuit breaker opened',
+}
+
+_ID_RE = re.compile(r"/\d+(?=/|$)")
+
+_current = contextvars.ContextVar('timings', default=None)
+_END = object()
+
+
+def endpoint_label(endpoint):
+    """Collapse ids so every ticket's notes share one label: service/tickets/{id}/notes."""
+    return _ID_RE.sub("/{id}", endpoint)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """Process-wide histograms and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def inc(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        """Prometheus text exposition of every metric."""
+        with self._lock:
+            histograms = {key: dict(h, buckets=list(h['buckets'])) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), h in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(BUCKETS, h['buckets']):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Timings:
+    """Per-report breakdown: call count and total seconds per span, plus counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name + _format_labels(_label_key(labels))
+
+    def add(self, name, seconds, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            entry = self.spans.setdefault(key, {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+
+    def inc(self, name, value, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'spans': {key: {'count': entry['count'], 'seconds': round(entry['seconds'], 3)}
+                          for key, entry in sorted(self.spans.items())},
+                'counters': dict(sorted(self.counters.items()))
+            }
+
+
+registry = Registry()
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """Time the enclosed block as one observation of `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def observe(name, seconds, **labels):
+    """Record a duration measured elsewhere."""
+    registry.observe(name, seconds, labels)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, labels)
+
+
+def count(name, value=1, **labels):
+    registry.inc(name, value, labels)
+    timings = _current.get()
+    if timings is not None:
+        timings.inc(name, value, labels)
+
+
+@contextlib.contextmanager
+def collect_timings():
+    """Collect a Timings breakdown of every span recorded (in any bound thread) inside the block."""
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def bind(fn, timings=None):
+    """Wrap fn so that, when run on another thread, its spans go to timings (default: the caller's)."""
+    if timings is None:
+        timings = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(timings)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def bind_iter(iterable, timings=None):
+    """Like bind, for an iterator consumed step by step: each step's spans go to timings (default: the caller's)."""
+    if timings is None:
+        timings = _current.get()
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = _current.set(timings)
+            try:
+                item = next(iterator, _END)
+            finally:
+                _current.reset(token)
+            if item is _END:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            bind(close, timings)()
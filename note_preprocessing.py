@@ -0,0 +1,178 @@
+"""
+Note-text preprocessing between the ConnectWise fetch and prompt building.
+
+Ticket notes are often emails: HTML remnants, quoted reply chains,
+signatures and repeated automated notes that add tokens but no facts.
+NotePreprocessor cleans each note, drops near-duplicates, caps each
+ticket's notes at a character budget and tracks the compression achieved.
+"""
+
+import html
+import os
+import re
+import threading
+
+# Only real tags (and comments): "<50ms ... >200ms" in a note is data, not markup
+TAG_RE = re.compile(r"</?[A-Za-z][^<>]*>|<!--.*?-->", re.DOTALL)
+BREAK_RE = re.compile(r"<\s*(br|/p|/div|/li|/tr)\s*/?\s*>", re.IGNORECASE)
+SPACE_RE = re.compile(r"[ \t\u00a0]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+WORD_RE = re.compile(r"[a-z]+")
+
+# A line that starts a quoted reply; everything after it is dropped
+REPLY_HEADER_RES = [
+    re.compile(r"^On .{0,200} wrote:\s*$", re.IGNORECASE),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^-{2,}\s*Forwarded message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^_{10,}\s*$"),
+]
+# Outlook-style quoted header: "From: ..." followed shortly by "Sent:"/"Date:"
+FROM_RE = re.compile(r"^From:\s.+$", re.IGNORECASE)
+SENT_RE = re.compile(r"^(Sent|Date):\s", re.IGNORECASE)
+# Lines that open a signature block (only honored near the end of a note)
+SIGNATURE_RES = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^(best|kind|warm)?\s*regards,?\s*$", re.IGNORECASE),
+    re.compile(r"^(thanks|thank you|cheers|sincerely)[,!.]?\s*$", re.IGNORECASE),
+    re.compile(r"^sent from my \w+", re.IGNORECASE),
+]
+# A signature is only stripped when it is within this many lines of the end
+SIGNATURE_MAX_LINES = 8
+# ...and every line after the opener looks like part of one: a short name or
+# title, or a contact line, never a sentence
+SIGNATURE_LINE_CHARS = 60
+SIGNATURE_LINE_WORDS = 5
+CONTACT_RE = re.compile(r"@|https?://|www\.|\d{3}[\s.-]?\d{4}|\|")
+# Notes whose word sets overlap at least this much count as duplicates
+DUPLICATE_SIMILARITY = 0.9
+
+
+def _signature_line(line):
+    """Whether a line could belong to a signature block (blank, a name/title, or contact details)."""
+    if not line:
+        return True
+    if len(line) > SIGNATURE_LINE_CHARS or line.endswith(('.', '!', '?')):
+        return False
+    return bool(CONTACT_RE.search(line)) or len(line.split()) <= SIGNATURE_LINE_WORDS
+
+
+def clean_note_text(text):
+    """Strip HTML, quoted replies and signatures and normalize whitespace."""
+    if not text:
+        return ""
+    text = BREAK_RE.sub("\n", text)
+    text = TAG_RE.sub("", text)
+    text = html.unescape(text).replace("\r\n", "\n").replace("\r", "\n")
+
+    raw_lines = [SPACE_RE.sub(" ", line).strip() for line in text.split("\n")]
+    lines = []
+    for i, line in enumerate(raw_lines):
+        if any(pattern.match(line) for pattern in REPLY_HEADER_RES):
+            break
+        if FROM_RE.match(line) and any(SENT_RE.match(nxt) for nxt in raw_lines[i + 1:i + 4]):
+            break
+        if line.startswith(">"):
+            continue
+        lines.append(line)
+
+    for i, line in enumerate(lines):
+        if len(lines) - i <= SIGNATURE_MAX_LINES and any(pattern.match(line) for pattern in SIGNATURE_RES) \
+                and all(_signature_line(rest) for rest in lines[i + 1:]):
+            lines = lines[:i]
+            break
+
+    return BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _fingerprint(text):
+    """Words of a note, ignoring case, numbers and punctuation (timestamps, ids)."""
+    return frozenset(WORD_RE.findall(text.lower()))
+
+
+def _similar(a, b):
+    if not a or not b:
+        return a == b
+    return len(a & b) / len(a | b) >= DUPLICATE_SIMILARITY
+
+
+class NotePreprocessor:
+    """Cleans, de-duplicates and budgets ticket notes; safe to share across threads."""
+
+    def __init__(self, char_budget=None):
+        # Maximum characters of note text kept per ticket (NOTE_CHAR_BUDGET, 0 = unlimited)
+        self.char_budget = char_budget if char_budget is not None else int(os.getenv("NOTE_CHAR_BUDGET", "4000"))
+        self.raw_chars = 0
+        self.kept_chars = 0
+        self.notes_in = 0
+        self.notes_kept = 0
+        self._lock = threading.Lock()
+
+    def process(self, notes):
+        """
+        Return the notes worth sending to the LLM, as note dicts with cleaned 'text'.
+        When a ticket's notes exceed the budget, the first note (the problem) and the
+        most recent notes (the resolution) are kept and the middle is omitted.
+        """
+        notes = notes or []
+        kept = []
+        fingerprints = []
+        for note in notes:
+            text = clean_note_text(note.get('text'))
+            if not text:
+                continue
+            fingerprint = _fingerprint(text)
+            if any(_similar(fingerprint, seen) for seen in fingerprints):
+                continue
+            fingerprints.append(fingerprint)
+            kept.append(dict(note, text=text))
+
+        kept = self._apply_budget(kept)
+
+        with self._lock:
+            self.notes_in += len(notes)
+            self.notes_kept += len(kept)
+            self.raw_chars += sum(len(n.get('text') or "") for n in notes)
+            self.kept_chars += sum(len(n['text']) for n in kept)
+        return kept
+
+    def _apply_budget(self, notes):
+        budget = self.char_budget
+        if not budget or sum(len(n['text']) for n in notes) <= budget:
+            return notes
+
+        first = notes[0]
+        head_chars = budget // 3
+        if len(first['text']) > head_chars:
+            first = dict(first, text=first['text'][:head_chars] + " [...]")
+        remaining = budget - len(first['text'])
+
+        tail = []
+        for note in reversed(notes[1:]):
+            if len(note['text']) > remaining:
+                if not tail and remaining > 0:
+                    # Always keep some of the latest note
+                    tail.append(dict(note, text=note['text'][:remaining] + " [...]"))
+                break
+            tail.append(note)
+            remaining -= len(note['text'])
+        tail.reverse()
+
+        omitted = len(notes) - 1 - len(tail)
+        if omitted:
+            marker = {'dateCreated': notes[1].get('dateCreated'), 'text': f"[{omitted} notes omitted]"}
+            return [first, marker] + tail
+        return [first] + tail
+
+    @property
+    def compression_ratio(self):
+        """Kept characters as a fraction of the raw note text (1.0 = nothing removed)."""
+        return self.kept_chars / self.raw_chars if self.raw_chars else 1.0
+
+    def stats(self):
+        return {
+            'notes_in': self.notes_in,
+            'notes_kept': self.notes_kept,
+            'raw_chars': self.raw_chars,
+            'kept_chars': self.kept_chars,
+            'compression_ratio': round(self.compression_ratio, 3)
+        }
@@ -0,0 +1,95 @@
+"""
+Batch report generation: one date range, many technicians.
+
+Instead of one search and one pipeline per technician, tickets for the whole
+team are searched with combined `owner/identifier in (...)` conditions and
+share a single detail fan-out (and the ticket/response caches). Reports are
+then written concurrently, bounded by the provider concurrency cap.
+"""
+
+import concurrent.futures
+import metrics
+from ticket_pipeline import TicketPipeline
+
+# Members per `owner/identifier in (...)` search, keeping request URLs short
+MEMBER_CHUNK_SIZE = 25
+
+NO_TICKETS_REPORT = '# No Tickets Found\n\nNo tickets were found for the selected criteria.'
+
+
+def member_conditions(member_ids, chunk_size=MEMBER_CHUNK_SIZE):
+    """Build the ticket search conditions for a set of members (the date range is applied by the search)."""
+    conditions = []
+    for i in range(0, len(member_ids), chunk_size):
+        chunk = ", ".join(f'"{m}"' for m in member_ids[i:i + chunk_size])
+        conditions.append(f'owner/identifier in ({chunk})')
+    return conditions
+
+
+def ticket_owner(t):
+    """The ticket owner's identifier, lower-cased (ConnectWise identifiers ignore case)."""
+    return ((t.get('owner') or {}).get('identifier') or "").lower()
+
+
+def run_batch_reports(cw, llm, members, start_date, end_date, preprocessor=None, async_client=None,
+                      on_progress=None):
+    """
+    Generate one report per member.
+    members: {identifier: technician_name}
+    on_progress: Optional callback(stage, done, total); the 'llm' stage counts finished reports.
+    Returns {'reports': {identifier: result}, 'ticket_count': ..., 'failed_count': ...}, where each
+    result has the /api/generate fields, or 'error' if that member's report failed.
+    """
+    def report(stage, done, total):
+        if on_progress:
+            on_progress(stage, done, total)
+
+    member_ids = list(members)
+    # Each ticket's notes are filtered to the technician who owns it
+    pipeline = TicketPipeline(cw, member_id=lambda t: (t.get('owner') or {}).get('identifier'),
+                              preprocessor=preprocessor, async_client=async_client)
+    records_by_owner = {}
+    tickets_by_owner = {}
+    failed_count = 0
+    for conditions in member_conditions(member_ids):
+        grouped = pipeline.collect_by(conditions, ticket_owner, on_progress=on_progress,
+                                      date_range=(start_date, end_date))
+        for owner, records in grouped.items():
+            records_by_owner.setdefault(owner, []).extend(records)
+        for owner in pipeline.ticket_keys:
+            tickets_by_owner[owner] = tickets_by_owner.get(owner, 0) + 1
+        failed_count += pipeline.failed_count
+
+    def generate(member_id):
+        records = records_by_owner.get(member_id.lower(), [])
+        ticket_count = tickets_by_owner.get(member_id.lower(), 0)
+        if not ticket_count:
+            return {'report': NO_TICKETS_REPORT, 'ticket_count': 0, 'processed_count': 0}
+        report = llm.summarize_quarterly_work(records, members[member_id])
+        provider, model = llm.answered_by or (llm.provider, llm.model)
+        return {
+            'report': report,
+            'provider': provider,
+            'model': model,
+            'ticket_count': ticket_count,
+            'processed_count': len(records)
+        }
+
+    # The provider cap in LLMProcessor bounds how many of these actually call the API at once
+    reports = {}
+    report('llm', 0, len(member_ids))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=llm.provider_concurrency) as executor:
+        futures = {executor.submit(metrics.bind(generate), member_id): member_id for member_id in member_ids}
+        for future in concurrent.futures.as_completed(futures):
+            member_id = futures[future]
+            try:
+                reports[member_id] = future.result()
+            except Exception as e:
+                reports[member_id] = {'error': str(e)}
+            report('llm', len(reports), len(member_ids))
+
+    return {
+        'reports': {member_id: reports[member_id] for member_id in member_ids},
+        'ticket_count': sum(tickets_by_owner.values()),
+        'failed_count': failed_count
+    }
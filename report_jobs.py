@@ -0,0 +1,108 @@
+"""
+In-process background job queue for report generation.
+
+Reports run on a bounded thread pool instead of the request thread, so web
+workers stay free. Identical in-flight jobs (same key) are deduplicated and
+finished jobs are kept for a while so clients can poll for the result.
+"""
+
+import os
+import threading
+import time
+import uuid
+import concurrent.futures
+
+
+class Job:
+    """State of one queued/running/finished report job."""
+
+    def __init__(self, job_id, key):
+        self.id = job_id
+        self.key = key
+        self.status = 'queued'
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def set_progress(self, stage, done, total):
+        self.progress = {'stage': stage, 'done': done, 'total': total}
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == 'succeeded':
+            data['result'] = self.result
+        if self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+
+class JobManager:
+    """Runs jobs on a local thread pool with in-flight deduplication."""
+
+    def __init__(self, max_workers=None, ttl=None):
+        self.max_workers = max_workers or int(os.getenv("REPORT_JOB_WORKERS", "2"))
+        # Seconds a finished job stays pollable
+        self.ttl = ttl if ttl is not None else int(os.getenv("REPORT_JOB_TTL", "3600"))
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="report-job"
+        )
+        self._jobs = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queue fn(*args, on_progress=..., **kwargs) unless an identical job is in flight.
+        Returns (job, created); created is False when an existing job was reused.
+        """
+        with self._lock:
+            self._evict_expired()
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                return self._jobs[job_id], False
+
+            job = Job(uuid.uuid4().hex, key)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job.id
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, on_progress=job.set_progress, **kwargs)
+            job.status = 'succeeded'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._in_flight.get(job.key) == job.id:
+                    del self._in_flight[job.key]
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,113 @@
+"""
+Stored reports, so a refresh can extend a report instead of rebuilding it.
+
+Every generated report is saved with the ticket ids it covers and a
+high-water mark: the ConnectWise time its ticket search started (less the
+sync overlap). A delta report searches only tickets entered or updated
+after that mark - entering a ticket sets its lastUpdated, so one
+`lastUpdated > [mark]` condition finds both - and asks the LLM to merge
+them into the stored text. A delta with a later end_date also searches
+every ticket entered after the stored end_date, however old its
+lastUpdated. A report with failed tickets keeps an earlier mark, so the
+next delta fetches them again. Reports expire after REPORT_STORE_TTL
+seconds.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from date_shards import parse_date
+from sqlite_store import connect, path_from_env
+from ticket_cache import SYNC_OVERLAP, format_cw_datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    base_id TEXT,
+    member_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    high_water TEXT NOT NULL,
+    ticket_ids TEXT NOT NULL,
+    report TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def high_water_mark(started_at=None):
+    """The high-water mark for a search started at started_at (default: now), in ConnectWise format."""
+    return format_cw_datetime((started_at or datetime.now(timezone.utc)) - SYNC_OVERLAP)
+
+
+def period_start_mark(start_date):
+    """A high-water mark below every ticket of a period starting on start_date: a delta from it re-fetches them all."""
+    start = parse_date(start_date)
+    return high_water_mark(datetime(start.year, start.month, start.day, tzinfo=timezone.utc))
+
+
+def delta_conditions(conditions, high_water, covered_until=None):
+    """
+    Narrow report conditions to tickets entered or updated after the high-water mark.
+    covered_until: The stored report's end_date when the new one ends later; tickets
+    entered after it are new to the report whenever they were last updated.
+    """
+    delta = f"lastUpdated > [{high_water}]"
+    if covered_until is not None:
+        extension_start = parse_date(covered_until) + timedelta(days=1)
+        delta = f"({delta} OR dateEntered >= [{extension_start.isoformat()}])"
+    return f"({conditions}) AND {delta}" if conditions else delta
+
+
+class ReportStore:
+    """SQLite store of generated reports, their covered ticket ids and high-water marks."""
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl if ttl is not None else int(os.getenv("REPORT_STORE_TTL", str(180 * 24 * 3600)))
+        self._lock = threading.Lock()
+        self._conn = connect(path, SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """Build the store from REPORT_STORE_PATH, or return None when it is "off"."""
+        path = path_from_env("REPORT_STORE_PATH", "reports.sqlite3")
+        return cls(path) if path else None
+
+    def save(self, member_id, start_date, end_date, provider, model, high_water, ticket_ids, report,
+             base_id=None):
+        """Store a report and return its id."""
+        report_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM reports WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "INSERT INTO reports (report_id, base_id, member_id, start_date, end_date, provider, model, "
+                "high_water, ticket_ids, report, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (report_id, base_id, member_id, str(start_date), str(end_date), provider, model, high_water,
+                 json.dumps(sorted(set(ticket_ids))), report, now),
+            )
+            self._conn.commit()
+        return report_id
+
+    def get(self, report_id):
+        """Return a stored report as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT report_id, base_id, member_id, start_date, end_date, provider, model, high_water, "
+                "ticket_ids, report, created_at FROM reports WHERE report_id = ? AND created_at >= ?",
+                (report_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ('report_id', 'base_id', 'member_id', 'start_date', 'end_date', 'provider', 'model', 'high_water',
+                'ticket_ids', 'report', 'created_at')
+        stored = dict(zip(keys, row))
+        stored['ticket_ids'] = json.loads(stored['ticket_ids'])
+        return stored
@@ -0,0 +1,214 @@
+"""
+Rate-limit-aware request scheduler for the ConnectWise API.
+
+Every ConnectWiseClient request goes through a shared RequestScheduler, which:
+- spaces requests with a token bucket (CW_RATE_LIMIT requests/second),
+- caps in-flight requests with a concurrency limit that grows while the API
+  is healthy and shrinks on throttling, errors or rising latency,
+- retries 429, 5xx, connection failures and resets mid-response with
+  exponential backoff and jitter, honoring Retry-After.
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Connection resets (including one partway through a response body) and timeouts are retried
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+# Latency above this multiple of the healthy baseline counts as congestion
+LATENCY_TOLERANCE = 2.0
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            return max(wait, self._paused_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for the given time (e.g. after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD concurrency limit tuned from observed latency and error rates.
+    Healthy responses grow the limit by roughly one slot per round trip;
+    throttling halves it, errors and latency spikes shrink it.
+    """
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._baseline = None
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def _set_limit(self, value):
+        self._limit = min(max(value, self.minimum), self.maximum)
+        self._cond.notify_all()
+
+    def on_success(self, latency):
+        with self._cond:
+            # Baseline follows new lows immediately and drifts up slowly
+            if self._baseline is None or latency < self._baseline:
+                self._baseline = latency
+            else:
+                self._baseline += 0.05 * (latency - self._baseline)
+
+            if latency > LATENCY_TOLERANCE * self._baseline:
+                self._set_limit(self._limit * 0.9)
+            else:
+                self._set_limit(self._limit + 1.0 / self._limit)
+
+    def on_throttle(self):
+        with self._cond:
+            self._set_limit(self._limit / 2)
+
+    def on_error(self):
+        with self._cond:
+            self._set_limit(self._limit * 0.75)
+
+
+class RequestScheduler:
+    """Shared scheduler that paces, limits and retries HTTP requests."""
+
+    def __init__(self, rate=None, burst=None, initial_concurrency=None, max_concurrency=None,
+                 max_retries=None, backoff_base=0.5, backoff_max=30.0):
+        rate = rate or float(os.getenv("CW_RATE_LIMIT", "20"))
+        max_concurrency = max_concurrency or int(os.getenv("CW_MAX_CONCURRENCY", "16"))
+        initial_concurrency = initial_concurrency or max(1, max_concurrency // 2)
+
+        self.bucket = TokenBucket(rate, burst or rate)
+        self.limit = AdaptiveConcurrencyLimit(initial_concurrency, 1, max_concurrency)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("CW_MAX_RETRIES", "5"))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @property
+    def max_concurrency(self):
+        """Upper bound on in-flight requests; use it to size worker pools."""
+        return self.limit.maximum
+
+    @property
+    def concurrency(self):
+        """Current adaptive in-flight limit."""
+        return self.limit.limit
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Exponential backoff with full jitter; Retry-After wins when it is longer."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def execute(self, send):
+        """
+        Run send() (a callable performing one HTTP request and returning a
+        requests.Response) under the rate and concurrency limits, retrying
+        transient failures. Connection errors are re-raised once retries run out.
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limit.acquire()
+            started = time.monotonic()
+            error = None
+            try:
+                response = send()
+            except RETRY_EXCEPTIONS as exc:
+                error = exc
+            finally:
+                # Any exception (e.g. a decoding error) must still free the slot, and
+                # the slot is freed before any backoff so a retry never sleeps holding it
+                self.limit.release()
+            latency = time.monotonic() - started
+
+            if error is not None:
+                self.limit.on_error()
+                if attempt >= self.max_retries:
+                    raise error
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = self.backoff_delay(attempt, retry_after)
+                if response.status_code == 429:
+                    self.limit.on_throttle()
+                    self.bucket.pause(delay)
+                else:
+                    self.limit.on_error()
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code < 400:
+                self.limit.on_success(latency)
+            return response
@@ -0,0 +1,81 @@
+"""
+In-process session storage for Flask-Session's cachelib backend.
+
+With SESSION_BACKEND=memory, sessions live in an LRU dict in the worker
+instead of pickled files under SESSION_FILE_DIR, so authenticated requests
+never touch the disk. Sessions expire after SESSION_TTL seconds and the
+least recently used are dropped beyond SESSION_MAX_ENTRIES. Sessions do
+not survive a restart and are not shared between worker processes (the
+Dockerfile runs a single one).
+"""
+
+import collections
+import threading
+import time
+
+from cachelib.base import BaseCache
+
+
+class LRUSessionCache(BaseCache):
+    """Thread-safe cachelib cache with per-entry expiry and LRU eviction."""
+
+    def __init__(self, max_entries=1000, default_timeout=3600):
+        super().__init__(default_timeout)
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires_at(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        # default_timeout is the cap: no entry outlives it, whatever timeout the caller passes
+        if self.default_timeout > 0:
+            timeout = min(timeout, self.default_timeout) if timeout > 0 else self.default_timeout
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def _live(self, key):
+        """The live (expires_at, value) entry, marked most recently used; None once expired. Call with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+        return None if entry is None else entry[1]
+
+    def has(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def _store(self, key, value, timeout):
+        self._entries[key] = (self._expires_at(timeout), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._store(key, value, timeout)
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._store(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
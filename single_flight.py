@@ -0,0 +1,110 @@
+"""
+Single-flight coalescing of identical ConnectWise GETs.
+
+Reports for overlapping teams ask for the same members, ticket pages, notes
+and time entries at about the same time. A SingleFlight shared by the
+clients lets the first caller of a (endpoint, params) pair make the request
+while identical concurrent callers wait for its parsed result, and keeps
+successful results for CW_COALESCE_TTL seconds in a small LRU
+(CW_COALESCE_ENTRIES) so near-simultaneous repeats are not sent either.
+Results are shared between callers and must be treated as read-only.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
+import metrics
+
+
+def request_key(endpoint, params=None):
+    """Hashable identity of a GET: the endpoint and its params in a fixed order."""
+    return endpoint, tuple(sorted((name, str(value)) for name, value in (params or {}).items()))
+
+
+class SingleFlight:
+    """Thread-safe in-flight table plus a TTL'd LRU of recent results; None results are never kept."""
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("CW_COALESCE_TTL", "10"))
+        self.max_entries = max_entries or int(os.getenv("CW_COALESCE_ENTRIES", "128"))
+        self._recent = collections.OrderedDict()
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """A fresh recent result, or None. Call with the lock held."""
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._recent[key]
+            return None
+        self._recent.move_to_end(key)
+        metrics.count('connectwise_coalesced_total', endpoint=metrics.endpoint_label(key[0]), source='recent')
+        return result
+
+    def _remember(self, key, result):
+        if result is None or self.ttl <= 0:
+            return
+        with self._lock:
+            self._recent[key] = (time.monotonic(), result)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_entries:
+                self._recent.popitem(last=False)
+
+    def do(self, key, fn):
+        """Return fn(), or the result of an identical call that is running or just finished."""
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                return result
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = concurrent.futures.Future()
+        if not leader:
+            metrics.count('connectwise_coalesced_total', endpoint=metrics.endpoint_label(key[0]), source='in_flight')
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(exc)
+            raise
+        self._remember(key, result)
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key, fn):
+        """Like do, for a coroutine function; callers share the event loop of the first one."""
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                return result
+            task = self._async_in_flight.get(key)
+            if task is None:
+                task = self._async_in_flight[key] = asyncio.ensure_future(self._lead_async(key, fn))
+            else:
+                metrics.count('connectwise_coalesced_total', endpoint=metrics.endpoint_label(key[0]),
+                              source='in_flight')
+        # A waiter being cancelled must not cancel the shared request
+        return await asyncio.shield(task)
+
+    async def _lead_async(self, key, fn):
+        try:
+            result = await fn()
+            self._remember(key, result)
+            return result
+        finally:
+            with self._lock:
+                del self._async_in_flight[key]
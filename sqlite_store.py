@@ -0,0 +1,33 @@
+"""
+Shared setup for the app's SQLite stores (ticket cache, LLM response cache,
+stored reports).
+
+Each store keeps one connection that every thread uses behind the store's
+own lock, in WAL mode so other worker processes can read while one writes.
+Their paths come from environment variables, where "off" disables the store.
+"""
+
+import os
+import sqlite3
+
+
+def connect(path, schema, pragmas=()):
+    """Open (creating its directory) a thread-shared WAL-mode connection to path and apply schema."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in pragmas:
+        conn.execute(f"PRAGMA {pragma}")
+    conn.executescript(schema)
+    conn.commit()
+    return conn
+
+
+def path_from_env(name, filename):
+    """The store path set in env var name (default .cache/filename), or None when it is "off" or empty."""
+    path = os.getenv(name, os.path.join(".cache", filename))
+    if not path or path.lower() == "off":
+        return None
+    return path
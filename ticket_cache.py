@@ -0,0 +1,169 @@
+"""
+Persistent local cache of ConnectWise tickets, notes and time totals.
+
+Details are keyed by ticket id plus the ticket's `_info.lastUpdated`, so a
+ticket that has not changed (every closed ticket) is served from disk, and
+any edit - a new note, time entry or status change - bumps lastUpdated and
+misses the cache. Search results are remembered per query and refreshed
+incrementally with a `lastUpdated > [last sync]` condition.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlite_store import connect, path_from_env
+
+# Overlap incremental syncs to tolerate clock skew between us and ConnectWise
+SYNC_OVERLAP = timedelta(minutes=5)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    last_updated TEXT,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (id, kind)
+);
+CREATE TABLE IF NOT EXISTS queries (
+    query_key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    synced_at TEXT NOT NULL,
+    ticket_ids TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notes (
+    ticket_id INTEGER NOT NULL,
+    member_key TEXT NOT NULL,
+    last_updated TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (ticket_id, member_key)
+);
+CREATE TABLE IF NOT EXISTS hours (
+    ticket_id INTEGER PRIMARY KEY,
+    last_updated TEXT NOT NULL,
+    hours REAL NOT NULL
+);
+"""
+
+
+def format_cw_datetime(value):
+    """Format a datetime the way ConnectWise conditions expect it."""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def ticket_last_updated(ticket):
+    """Return a ticket's `_info.lastUpdated` stamp, or None."""
+    return (ticket.get('_info') or {}).get('lastUpdated')
+
+
+class TicketCache:
+    """SQLite-backed store shared by every thread (and worker process) of the app."""
+
+    def __init__(self, path, query_ttl=None):
+        self.path = path
+        # Search results are fully re-synced after this age, which drops tickets
+        # that stopped matching the query (e.g. reassigned to another owner)
+        self.query_ttl = timedelta(seconds=query_ttl if query_ttl is not None
+                                   else int(os.getenv("CW_CACHE_QUERY_TTL", "86400")))
+        # Queries over a closed (past) date shard can only lose tickets by
+        # reassignment, so they are fully re-synced less often
+        self.closed_query_ttl = timedelta(seconds=int(os.getenv("CW_CACHE_CLOSED_QUERY_TTL", "604800")))
+        self._lock = threading.Lock()
+        self._conn = connect(path, SCHEMA, pragmas=("synchronous=NORMAL",))
+
+    @classmethod
+    def from_env(cls):
+        """Build the cache from CW_CACHE_PATH, or return None when it is "off"."""
+        path = path_from_env("CW_CACHE_PATH", "connectwise.sqlite3")
+        return cls(path) if path else None
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def _executemany(self, sql, rows):
+        with self._lock:
+            self._conn.executemany(sql, rows)
+            self._conn.commit()
+
+    # Ticket searches
+
+    def get_query(self, query_key, ttl=None):
+        """Return (synced_at, ticket_ids) for a fresh cached query, or None. ttl defaults to query_ttl."""
+        rows = self._execute("SELECT synced_at, ticket_ids FROM queries WHERE query_key = ?", (query_key,))
+        if not rows:
+            return None
+        synced_at, ticket_ids = rows[0]
+        synced = datetime.strptime(synced_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - synced > (ttl or self.query_ttl):
+            return None
+        return synced_at, json.loads(ticket_ids)
+
+    def save_query(self, query_key, kind, started_at, ticket_ids):
+        """Record a completed sync; started_at is when the sync's first request went out."""
+        synced_at = format_cw_datetime(started_at - SYNC_OVERLAP)
+        self._execute(
+            "INSERT OR REPLACE INTO queries (query_key, kind, synced_at, ticket_ids) VALUES (?, ?, ?, ?)",
+            (query_key, kind, synced_at, json.dumps(sorted(set(ticket_ids)))),
+        )
+
+    def put_tickets(self, kind, tickets):
+        self._executemany(
+            "INSERT OR REPLACE INTO tickets (id, kind, last_updated, payload) VALUES (?, ?, ?, ?)",
+            [(t['id'], kind, ticket_last_updated(t), json.dumps(t)) for t in tickets],
+        )
+
+    def get_tickets(self, kind, ticket_ids):
+        """Return cached ticket payloads for the given ids (missing ids are skipped)."""
+        tickets = []
+        ids = list(ticket_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._execute(
+                f"SELECT payload FROM tickets WHERE kind = ? AND id IN ({placeholders})",
+                (kind, *chunk),
+            )
+            tickets.extend(json.loads(payload) for (payload,) in rows)
+        return tickets
+
+    # Ticket details
+
+    def get_notes(self, ticket_id, note_key, last_updated):
+        """note_key identifies the endpoint and filters (member, dates) the notes were fetched with."""
+        rows = self._execute(
+            "SELECT payload FROM notes WHERE ticket_id = ? AND member_key = ? AND last_updated = ?",
+            (ticket_id, note_key or "", last_updated),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def put_notes(self, ticket_id, note_key, last_updated, notes):
+        self._execute(
+            "INSERT OR REPLACE INTO notes (ticket_id, member_key, last_updated, payload) VALUES (?, ?, ?, ?)",
+            (ticket_id, note_key or "", last_updated, json.dumps(notes)),
+        )
+
+    def get_hours(self, versions):
+        """Return {ticket_id: hours} for tickets whose cached lastUpdated matches versions."""
+        hours = {}
+        items = [(t_id, stamp) for t_id, stamp in versions.items() if stamp]
+        for i in range(0, len(items), 500):
+            chunk = items[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._execute(
+                f"SELECT ticket_id, last_updated, hours FROM hours WHERE ticket_id IN ({placeholders})",
+                tuple(t_id for t_id, _ in chunk),
+            )
+            for t_id, stamp, total in rows:
+                if versions.get(t_id) == stamp:
+                    hours[t_id] = total
+        return hours
+
+    def put_hours(self, versions, hours):
+        self._executemany(
+            "INSERT OR REPLACE INTO hours (ticket_id, last_updated, hours) VALUES (?, ?, ?)",
+            [(t_id, versions[t_id], total) for t_id, total in hours.items() if versions.get(t_id)],
+        )
@@ -0,0 +1,332 @@
+"""
+Shared ticket-processing pipeline used by the web app and the CLI.
+
+Stages run on their own threads, connected by bounded queues, so a slow
+stage applies backpressure to the ones before it instead of everything
+being buffered in memory:
+
+    search -> details -> normalize -> consumer (prompt building)
+
+search streams service and project tickets page by page (both searches at
+once, merged into one de-duplicated stream) and groups them into
+micro-batches whose time totals are fetched with one bulk call;
+details fetches each ticket's notes; normalize cleans the notes and builds
+the compact TicketRecord LLMProcessor expects. Raw ticket payloads are
+dropped as soon as their record is built.
+"""
+
+import contextlib
+import os
+import queue
+import threading
+import time
+import concurrent.futures
+import metrics
+from connectwise_client import NOTE_FIELDS, TICKET_FIELDS, TICKET_ID_CHUNK_SIZE
+from ticket_cache import ticket_last_updated
+from ticket_record import TicketRecord
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+def build_ticket_record(t, notes, total_hours, preprocessor=None, pool=None):
+    """Reduce a ticket and its notes to the compact TicketRecord LLMProcessor reads."""
+    if preprocessor is not None:
+        notes = preprocessor.process(notes)
+    return TicketRecord.from_ticket(t, notes, total_hours, pool)
+
+
+def _newest_first(item):
+    """Sort key for (index, record): highest (newest) ticket id first."""
+    return -item[1].id
+
+
+class TicketPipeline:
+    """
+    Runs search -> details -> normalize for one set of conditions.
+    member_id: Only fetch notes written by this member (None = all notes), or a
+               callable(ticket) returning the member for each ticket.
+    preprocessor: Optional NotePreprocessor applied in the normalize stage.
+    async_client: Optional AsyncClientAdapter; details are then fetched a whole
+                  micro-batch at a time on its event loop instead of per ticket.
+    cache_query: False searches without the ticket query cache, for one-off conditions.
+    """
+
+    def __init__(self, cw, member_id=None, preprocessor=None, async_client=None,
+                 detail_workers=None, normalize_workers=None, queue_size=None, batch_size=TICKET_ID_CHUNK_SIZE,
+                 cache_query=True):
+        self.cw = cw
+        self.member_id = member_id
+        self.preprocessor = preprocessor
+        self.async_client = async_client
+        self.cache_query = cache_query
+        # Per-stage parallelism and queue depth (PIPELINE_DETAIL_WORKERS,
+        # PIPELINE_NORMALIZE_WORKERS, PIPELINE_QUEUE_SIZE)
+        self.detail_workers = detail_workers or int(os.getenv("PIPELINE_DETAIL_WORKERS", cw.scheduler.max_concurrency))
+        self.normalize_workers = normalize_workers or int(os.getenv("PIPELINE_NORMALIZE_WORKERS", "2"))
+        self.queue_size = queue_size or int(os.getenv("PIPELINE_QUEUE_SIZE", "256"))
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Raw ticket payloads are dropped once their record is built; only the
+        # count (and the collect_by key per ticket) outlives the normalize stage
+        self.ticket_count = 0
+        self.ticket_keys = []
+        self._pool = {}
+        self.failed_count = 0
+        self.processed_count = 0
+        self.search_done = False
+        self.stage_seconds = {'search': 0.0, 'hours': 0.0, 'details': 0.0, 'normalize': 0.0}
+        self._errors = []
+        # The report's (start_date, end_date); notes outside it are filtered out by ConnectWise
+        self.date_range = None
+
+    def run(self, conditions, on_progress=None, date_range=None):
+        """
+        Yield ticket records as they become ready (completion order).
+        on_progress: Optional callback(stage, done, total) for progress reporting.
+        date_range: Optional (start_date, end_date), inclusive: tickets entered in it are searched
+        in date shards, and only notes created in it are fetched.
+        Re-raises the first error that stopped a stage.
+        """
+        for _, record in self._run(conditions, on_progress, date_range=date_range):
+            yield record
+
+    def collect(self, conditions, on_progress=None, date_range=None):
+        """
+        Run to completion and return the records newest ticket first. Searches run in
+        parallel, so arrival order varies; a fixed order keeps prompts (and cache hits) stable.
+        """
+        return [record for _, record in sorted(self._run(conditions, on_progress, date_range=date_range),
+                                               key=_newest_first)]
+
+    def collect_by(self, conditions, key, on_progress=None, date_range=None):
+        """Like collect, but returns {key(ticket): [records]} (e.g. grouped by owner)."""
+        grouped = {}
+        for index, record in sorted(self._run(conditions, on_progress, key, date_range), key=_newest_first):
+            grouped.setdefault(self.ticket_keys[index], []).append(record)
+        return grouped
+
+    def _notes_member(self, t):
+        return self.member_id(t) if callable(self.member_id) else self.member_id
+
+    @contextlib.contextmanager
+    def _stage(self, stage):
+        """Time a unit of stage work, for stats() and the pipeline_stage_seconds metric."""
+        started = time.monotonic()
+        try:
+            with metrics.span('pipeline_stage_seconds', stage=stage):
+                yield
+        finally:
+            with self._lock:
+                self.stage_seconds[stage] += time.monotonic() - started
+
+    def stats(self):
+        return {
+            'ticket_count': self.ticket_count,
+            'processed_count': self.processed_count,
+            'failed_count': self.failed_count,
+            'stage_seconds': {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()}
+        }
+
+    def _run(self, conditions, on_progress, key=None, date_range=None):
+        self._reset()
+        self.date_range = date_range
+        stop = threading.Event()
+        detail_queue = queue.Queue(self.queue_size)
+        normalize_queue = queue.Queue(self.queue_size)
+        output_queue = queue.Queue(self.queue_size)
+        hours_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipeline-hours")
+
+        def report(stage, done, total):
+            if on_progress:
+                on_progress(stage, done, total)
+
+        def stage_thread(name, target, *args):
+            thread = threading.Thread(target=metrics.bind(self._guard), args=(stop, target, *args), name=name,
+                                      daemon=True)
+            thread.start()
+            return thread
+
+        def finish(threads, next_queue, count):
+            # Once every worker of a stage is done, tell each worker of the next one
+            for thread in threads:
+                thread.join()
+            for _ in range(count):
+                self._put(next_queue, _DONE, stop)
+
+        search = stage_thread("pipeline-search", self._search, conditions, date_range, key, detail_queue,
+                              hours_executor, stop, report)
+        details = [stage_thread(f"pipeline-details-{i}", self._details, detail_queue, normalize_queue, stop)
+                   for i in range(self.detail_workers)]
+        normalizers = [stage_thread(f"pipeline-normalize-{i}", self._normalize, normalize_queue, output_queue,
+                                    stop, report)
+                       for i in range(self.normalize_workers)]
+        threading.Thread(target=finish, args=([search], detail_queue, len(details)), daemon=True).start()
+        threading.Thread(target=finish, args=(details, normalize_queue, len(normalizers)), daemon=True).start()
+        threading.Thread(target=finish, args=(normalizers, output_queue, 1), daemon=True).start()
+
+        try:
+            while True:
+                item = self._get(output_queue, stop)
+                if item is _DONE:
+                    break
+                yield item
+            if self._errors:
+                raise self._errors[0]
+        finally:
+            # Also runs when the consumer stops early: unblock and stop every stage
+            stop.set()
+            hours_executor.shutdown(wait=False, cancel_futures=True)
+            # The records keep the strings they share; the lookup table can go
+            self._pool = {}
+
+    def _guard(self, stop, target, *args):
+        try:
+            target(*args)
+        except Exception as exc:
+            with self._lock:
+                self._errors.append(exc)
+            stop.set()
+
+    @staticmethod
+    def _put(q, item, stop):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(q, stop):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _search(self, conditions, date_range, key, detail_queue, hours_executor, stop, report):
+        # Service and project searches (per date shard) run concurrently; only the
+        # fields a record and the caches need are downloaded
+        stream = self.cw.iter_all_tickets(conditions, fields=TICKET_FIELDS, date_range=date_range,
+                                          cache_query=self.cache_query)
+        batch = []
+        try:
+            for t in self._timed_search(stream):
+                batch.append((self.ticket_count, t))
+                if key is not None:
+                    self.ticket_keys.append(key(t))
+                self.ticket_count += 1
+                report('search', self.ticket_count, None)
+                if len(batch) >= self.batch_size:
+                    if not self._dispatch(batch, detail_queue, hours_executor, stop):
+                        return
+                    batch = []
+            if batch:
+                self._dispatch(batch, detail_queue, hours_executor, stop)
+        finally:
+            self.search_done = True
+
+    def _timed_search(self, stream):
+        """Yield from the search stream, timing only the waits on ConnectWise (not downstream backpressure)."""
+        iterator = iter(stream)
+        waited = 0.0
+        try:
+            while True:
+                started = time.monotonic()
+                t = next(iterator, _DONE)
+                waited += time.monotonic() - started
+                if t is _DONE:
+                    return
+                yield t
+        finally:
+            with self._lock:
+                self.stage_seconds['search'] += waited
+            metrics.observe('pipeline_stage_seconds', waited, stage='search')
+
+    def _fetch_hours(self, ticket_ids, versions):
+        with self._stage('hours'):
+            return self.cw.get_time_totals(ticket_ids=ticket_ids, versions=versions)
+
+    def _dispatch(self, batch, detail_queue, hours_executor, stop):
+        """Queue one micro-batch for the details stage; returns False once the pipeline stopped."""
+        if self.async_client is not None:
+            return self._put(detail_queue, batch, stop)
+
+        # Time totals for the whole batch come from one bulk call, fetched alongside the notes
+        versions = {t['id']: ticket_last_updated(t) for _, t in batch}
+        hours = hours_executor.submit(metrics.bind(self._fetch_hours), list(versions), versions)
+        for index, t in batch:
+            if not self._put(detail_queue, (index, t, hours), stop):
+                return False
+        return True
+
+    def _details(self, detail_queue, normalize_queue, stop):
+        while True:
+            item = self._get(detail_queue, stop)
+            if item is _DONE:
+                return
+            with self._stage('details'):
+                results = self._fetch_details(item)
+            for result in results:
+                if not self._put(normalize_queue, result, stop):
+                    return
+
+    def _fetch_details(self, item):
+        """Fetch notes for one detail-queue item; returns (index, ticket, notes, hours) tuples."""
+        if self.async_client is not None:
+            by_member = {}
+            for index, t in item:
+                by_member.setdefault(self._notes_member(t), []).append((index, t))
+            results = []
+            for member_id, group in by_member.items():
+                notes_by_ticket, hours_by_ticket = self.async_client.fetch_ticket_details(
+                    [t for _, t in group], member_id=member_id, note_fields=NOTE_FIELDS, date_range=self.date_range
+                )
+                results.extend((index, t, notes_by_ticket.get(t['id']), hours_by_ticket) for index, t in group)
+            return results
+
+        index, t, hours = item
+        try:
+            notes = self.cw.get_ticket_notes(t['id'], member_id=self._notes_member(t),
+                                             last_updated=ticket_last_updated(t), fields=NOTE_FIELDS,
+                                             ticket_type=t.get('ticketType'), date_range=self.date_range)
+        except Exception as exc:
+            notes = exc
+        return [(index, t, notes, hours)]
+
+    def _normalize(self, normalize_queue, output_queue, stop, report):
+        while True:
+            item = self._get(normalize_queue, stop)
+            if item is _DONE:
+                return
+            index, t, notes, hours = item
+            if isinstance(hours, concurrent.futures.Future):
+                try:
+                    hours = hours.result()
+                except Exception as exc:
+                    hours = exc
+
+            record = None
+            if isinstance(notes, Exception) or isinstance(hours, Exception):
+                # Unknown hours would be reported as 0.0, so the ticket fails like one without notes
+                print(f"Skipping ticket {t['id']}: {notes if isinstance(notes, Exception) else hours}")
+            else:
+                with self._stage('normalize'):
+                    record = build_ticket_record(t, notes, hours.get(t['id'], 0.0), self.preprocessor, self._pool)
+            with self._lock:
+                if record is None:
+                    self.failed_count += 1
+                else:
+                    self.processed_count += 1
+                done = self.processed_count + self.failed_count
+
+            report('details', done, self.ticket_count if self.search_done else None)
+            if record is not None and not self._put(output_queue, (index, record), stop):
+                return
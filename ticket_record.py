@@ -0,0 +1,76 @@
+"""
+Compact in-memory form of a processed ticket.
+
+Every record of a report stays alive until its prompt is built, so a record
+keeps only the fields the prompt needs - no raw API payload - in __slots__,
+with notes as (date, text) segments rather than one joined string. The
+segments are deduplicated through a per-report pool, so repeated automated
+notes and shared timestamps are stored once. Records still read like the
+dicts LLMProcessor has always accepted: record['notes'] joins on demand.
+"""
+
+
+class TicketRecord:
+    """One ticket's prompt data: id, summary, date, total_hours and note segments."""
+
+    __slots__ = ('id', 'summary', 'date', 'total_hours', 'note_segments')
+
+    KEYS = ('id', 'summary', 'date', 'notes', 'total_hours')
+
+    def __init__(self, ticket_id, summary, date, total_hours, note_segments=()):
+        self.id = ticket_id
+        self.summary = summary
+        self.date = date
+        self.total_hours = total_hours
+        self.note_segments = tuple(note_segments)
+
+    @classmethod
+    def from_ticket(cls, t, notes, total_hours, pool=None):
+        """
+        Build a record from a raw ticket and its note dicts.
+        pool: Optional dict shared by a report's records to deduplicate note strings.
+        """
+        def share(value):
+            value = str(value)
+            return pool.setdefault(value, value) if pool is not None else value
+
+        segments = tuple((share(n.get('dateCreated')), share(n.get('text'))) for n in notes or ())
+        date = t.get('dateClosed') or t.get('dateEntered') or "Unknown Date"
+        return cls(t['id'], t['summary'], date, total_hours, segments)
+
+    def notes_text(self):
+        return "\n".join(f"- [{date}] {text}" for date, text in self.note_segments)
+
+    def write_notes(self, write):
+        """Write the notes text piece by piece, without building the joined string."""
+        for i, (date, text) in enumerate(self.note_segments):
+            if i:
+                write("\n")
+            write("- [")
+            write(date)
+            write("] ")
+            write(text)
+
+    # Read-only mapping interface, for code written against the old dict records
+
+    def __getitem__(self, key):
+        if key == 'notes':
+            return self.notes_text()
+        if key in self.KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.KEYS
+
+    def to_dict(self):
+        return {key: self[key] for key in self.KEYS}
+
+    def __repr__(self):
+        return f"TicketRecord(id={self.id!r}, summary={self.summary!r}, notes={len(self.note_segments)})"